@@ -1,7 +1,11 @@
 # client.py
 import asyncio
 import json
+import random
+import time
 import websockets
+from collections import OrderedDict
+from itertools import islice
 from typing import Dict, Set
 
 from logger import Logger
@@ -22,10 +26,31 @@ from commands import dispatch, BotState, conv_key
 from permsvc import PermService
 from handinsvc import HandinService
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # 未安装 orjson 时回退到标准库
+    _json_loads = json.loads
+
 log = Logger("bot", "INFO")
 
 # 允许不同会话并发处理，避免大文件发送阻塞全局。
 MAX_DISPATCH_CONCURRENCY = 32
+# 会话锁最多保留多少个（LRU），避免长连接下每个新会话都留下一把锁。
+MAX_CONV_LOCKS = 4096
+# 超出上限时只检查最旧的这么多把锁，淘汰开销与会话总数无关
+CONV_LOCK_EVICT_SCAN = 32
+
+# 元事件（心跳等）原始帧特征：命中则无需解析 JSON。
+# 用户文本里的引号在 JSON 中会被转义，不会误判消息事件；
+# 若 NapCat 输出带空格的 JSON 则匹配不到，回退到解析后判断。
+_META_EVENT_MARK = '"post_type":"meta_event"'
+_META_EVENT_MARK_B = _META_EVENT_MARK.encode()
+
+# 断线重连：指数退避（带 ±20% 抖动），连接稳定存活超过 RECONNECT_STABLE_SECONDS 后重置。
+RECONNECT_BACKOFF_MIN = 1.0
+RECONNECT_BACKOFF_MAX = 60.0
+RECONNECT_STABLE_SECONDS = 30.0
 
 async def run_forever():
     filesvc = FileService()
@@ -34,7 +59,9 @@ async def run_forever():
     perm = PermService(PERM_DB_PATH)
     handin = HandinService(log)
 
+    backoff = RECONNECT_BACKOFF_MIN
     while True:
+        connected_at = None
         try:
             async with websockets.connect(
                 WS_URI,
@@ -43,51 +70,104 @@ async def run_forever():
                 ping_timeout=20,
                 close_timeout=5,
                 max_size=2 ** 22,
+                # NapCat 在本机（127.0.0.1），压缩只会白白消耗 CPU
+                compression=None,
             ) as ws:
                 # action 走 HTTP，WS 仅收事件（可显著减少超时/卡顿/误报失败）
                 api = OneBotAPI(ws, log, http_base=HTTP_BASE, http_token=HTTP_TOKEN)
                 logsvc = LogService(LOG_DIR, log)
                 dispatch_sem = asyncio.Semaphore(MAX_DISPATCH_CONCURRENCY)
-                conv_locks: Dict[str, asyncio.Lock] = {}
+                conv_locks: "OrderedDict[str, asyncio.Lock]" = OrderedDict()
+                # 每个会话锁当前被多少事件使用（持有或排队等待）；计数 > 0 的锁不能淘汰
+                conv_busy: Dict[str, int] = {}
                 inflight: Set[asyncio.Task] = set()
 
-                async def _handle_one_event(ctx, data: dict, text: str):
-                    key = conv_key(ctx)
+                def _get_conv_lock(key: str) -> asyncio.Lock:
                     lock = conv_locks.get(key)
-                    if lock is None:
-                        lock = asyncio.Lock()
-                        conv_locks[key] = lock
+                    if lock is not None:
+                        conv_locks.move_to_end(key)
+                        return lock
+                    lock = asyncio.Lock()
+                    conv_locks[key] = lock
+                    if len(conv_locks) > MAX_CONV_LOCKS:
+                        # 只淘汰空闲的锁（没有事件持有或等待），正在使用的锁保留；
+                        # 最旧的一段都在用时本次先不淘汰，下一个新会话再试
+                        for old_key in list(islice(conv_locks, CONV_LOCK_EVICT_SCAN)):
+                            if len(conv_locks) <= MAX_CONV_LOCKS:
+                                break
+                            if old_key == key or old_key in conv_busy:
+                                continue
+                            del conv_locks[old_key]
+                    return lock
+
+                async def _handle_one_event(ctx, data: dict, key: str):
+                    lock = _get_conv_lock(key)
+                    # 取锁与计数之间没有 await：计数生效前不会发生淘汰
+                    conv_busy[key] = conv_busy.get(key, 0) + 1
+                    try:
+                        # 文本在任务里再提取，接收循环只做解析与分发
+                        text = get_text(data)
 
-                    async with dispatch_sem:
+                        # 先拿会话锁再占并发名额：同一会话排队的事件不占用全局名额
                         async with lock:
-                            try:
-                                await dispatch(api, ctx, data, text, filesvc, logsvc, state, handin, perm)
-                            except Exception as e:
-                                log.exception(f"dispatch 异常: {e}")
+                            async with dispatch_sem:
+                                try:
+                                    await dispatch(api, ctx, data, text, filesvc, logsvc, state, handin, perm)
+                                except Exception as e:
+                                    log.exception(f"dispatch 异常: {e}")
+                    finally:
+                        n = conv_busy[key] - 1
+                        if n:
+                            conv_busy[key] = n
+                        else:
+                            del conv_busy[key]
+
+                async def _approve_friend_request(flag: str, req_uid: int):
+                    try:
+                        await api.set_friend_add_request(
+                            flag=flag,
+                            approve=True,
+                            remark=AUTO_APPROVE_FRIEND_REMARK,
+                        )
+                    except Exception as e:
+                        log.warning(f"自动通过好友申请失败：user_id={req_uid}: {e}")
 
                 log.info("已连接至服务器")
+                connected_at = time.monotonic()
                 cleanup_task = asyncio.create_task(logsvc.cleanup_loop())
                 scheduler_task = asyncio.create_task(handin.scheduler_loop(api))
 
+                # 接收循环热路径：常用函数/方法先绑定为局部变量
+                loads = _json_loads
+                create_task = asyncio.create_task
+                track = inflight.add
+                untrack = inflight.discard
+
                 try:
                     async for message in ws:
-                        data = json.loads(message)
+                        if (_META_EVENT_MARK_B if isinstance(message, bytes) else _META_EVENT_MARK) in message:
+                            continue
+
+                        # 解析保持在事件循环内：orjson/json 解析期间全程持有 GIL，
+                        # 丢到线程池并不能与 dispatch 重叠，反而多一次线程切换且可能打乱事件顺序。
+                        data = loads(message)
+                        post_type = data.get("post_type")
+
+                        # 心跳/生命周期等元事件直接丢弃，不再走 ctx 构建
+                        if post_type == "meta_event":
+                            continue
 
                         # ===== 自动通过好友申请（post_type=request）=====
-                        if data.get("post_type") == "request" and data.get("request_type") == "friend":
+                        if post_type == "request" and data.get("request_type") == "friend":
                             if AUTO_APPROVE_FRIEND_REQUEST:
                                 flag = data.get("flag")
                                 req_uid = int(data.get("user_id") or 0)
                                 comment = str(data.get("comment") or "").strip()
                                 if flag:
                                     log.info(f"收到好友申请：user_id={req_uid} comment={comment!r} -> 自动通过")
-                                    asyncio.create_task(
-                                        api.set_friend_add_request(
-                                            flag=str(flag),
-                                            approve=True,
-                                            remark=AUTO_APPROVE_FRIEND_REMARK,
-                                        )
-                                    )
+                                    task = create_task(_approve_friend_request(str(flag), req_uid))
+                                    track(task)
+                                    task.add_done_callback(untrack)
                                 else:
                                     log.warning(f"收到好友申请但缺少 flag：{data}")
                             continue
@@ -95,34 +175,43 @@ async def run_forever():
                         # action 回包
                         if "echo" in data:
                             api.feed_response(data)
-                            if "post_type" not in data:
-                                continue
+
+                        # 只有消息事件需要构建 ctx / 提取文本（notice 等目前不处理）
+                        if post_type != "message":
+                            continue
 
                         ctx = build_ctx(data, perm=perm)
                         if not ctx:
                             continue
 
-                        text = get_text(data)
-                        task = asyncio.create_task(_handle_one_event(ctx, data, text))
-                        inflight.add(task)
-                        task.add_done_callback(lambda t: inflight.discard(t))
+                        task = create_task(_handle_one_event(ctx, data, conv_key(ctx)))
+                        track(task)
+                        task.add_done_callback(untrack)
                 finally:
-                    for t in (cleanup_task, scheduler_task):
-                        t.cancel()
-                    await asyncio.gather(cleanup_task, scheduler_task, return_exceptions=True)
-
-                    # 连接断开时尽量回收在途任务，避免跨连接残留。
-                    pending = list(inflight)
-                    if pending:
-                        done, waiting = await asyncio.wait(pending, timeout=2.0)
+                    cleanup_task.cancel()
+                    scheduler_task.cancel()
+
+                    # 连接断开时尽量回收在途任务，避免跨连接残留：
+                    # 给在途 dispatch 2 秒收尾（文件上传走 HTTP，不依赖 WS），超时再取消。
+                    waiting = set()
+                    if inflight:
+                        _, waiting = await asyncio.wait(list(inflight), timeout=2.0)
                         for t in waiting:
                             t.cancel()
-                        if waiting:
-                            await asyncio.gather(*waiting, return_exceptions=True)
+                    await asyncio.gather(cleanup_task, scheduler_task, *waiting, return_exceptions=True)
 
         except Exception as e:
             log.error(f"连接断开/异常：{e}")
-            await asyncio.sleep(2)
+
+        if connected_at is not None and time.monotonic() - connected_at >= RECONNECT_STABLE_SECONDS:
+            backoff = RECONNECT_BACKOFF_MIN
+        await asyncio.sleep(backoff * random.uniform(0.8, 1.2))
+        backoff = min(RECONNECT_BACKOFF_MAX, backoff * 2)
 
 if __name__ == "__main__":
-    asyncio.run(run_forever())
+    # uvloop.install() 依赖已弃用的事件循环策略 API，0.18+ 改用 uvloop.run
+    try:
+        from uvloop import run as _run
+    except ImportError:  # Windows / 未安装 uvloop（或版本低于 0.18）时使用默认事件循环
+        _run = asyncio.run
+    _run(run_forever())
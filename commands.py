@@ -2,19 +2,26 @@
 # commands.py
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
+from operator import attrgetter, itemgetter
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 import asyncio
+import heapq
+import itertools
+import os
 import re
 import time
 import shutil
+import stat
 import uuid
 import unicodedata
 import zipfile
 from filesvc import FileService
 from logsvc import LogService
-from handinsvc import HandinService, parse_mmdd_hhmm, pretty_ts, extract_name_from_filename, extract_student_id
+from handinsvc import HandinService, HandinTask, parse_mmdd_hhmm, pretty_ts, extract_name_from_filename, extract_student_id
 from router import get_files
 from config import (
     ADMIN_USERS,
@@ -36,35 +43,76 @@ from config import (
 
 LARGE_FILE_WARN_BYTES = int(LARGE_FILE_WARN_MB) * 1024 * 1024
 ANSWER_FILE_PATH = Path(__file__).resolve().parent / "answer.txt"
+# 多文件提交打包输出目录
+_HANDIN_BATCH_DIR = DATA_DIR / "temp" / "handin_batch"
 _ANSWER_CACHE_MTIME: Optional[float] = None
-_ANSWER_CACHE: Dict[str, List[str]] = {}
-
-
+# answer.txt 的 mtime 检查节流：间隔内不重复 stat（Windows/Docker 挂载上 stat 较贵）
+_ANSWER_CACHE_CHECK_INTERVAL = 2.0
+_ANSWER_CACHE_CHECK_TS: float = 0.0
+_ANSWER_CACHE: Dict[str, Tuple[str, ...]] = {}
+# 指令前缀（半角/全角斜杠），str.startswith 一次判断
+_CMD_PREFIXES = ("/", "／")
+
+_RE_WS = re.compile(r"\s+")
+_RE_DIGITS = re.compile(r"[0-9]+")
+_RE_ASCII_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+_RE_WIN_ILLEGAL = re.compile(r'[<>:"/\\|?*]+')
+_RE_DONE = re.compile(r"/?done", re.IGNORECASE)
+# 等待 zip 命名时表示“取消”的回复
+_ZIP_NAME_CANCEL_TOKENS = frozenset(("0", "取消", "/cancel", "／cancel"))
+# 删除 Windows 非法字符与控制字符（逐字符删除，str.translate 比正则快）
+_WIN_ILLEGAL_CTRL_DELETE = str.maketrans(dict.fromkeys('<>:"/\\|?*' + "".join(map(chr, range(32)))))
+# 已压缩格式：打包时直接存储（ZIP_STORED），再 deflate 只会白耗 CPU
+_PRECOMPRESSED_SUFFIXES = frozenset({
+    ".zip", ".rar", ".7z", ".gz", ".xz", ".bz2", ".zst", ".apk",
+    ".docx", ".xlsx", ".pptx", ".pdf",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp",
+    ".mp3", ".aac", ".mp4", ".mkv", ".mov", ".webm",
+})
+# 打包时读取源文件的缓冲大小
+_ZIP_COPY_BUFSIZE = 1 << 20
+# 全角数字 -> 半角
+_FW_DIGIT_TRANS = str.maketrans("０１２３４５６７８９", "0123456789")
+# 序号输入的常见形态（半角数字 + 空格/逗号分隔），命中时直接 split，不走正则
+_ASCII_DIGIT_SEP = frozenset("0123456789 ,，\t")
+
+
+# answer.txt 行前缀（q:/a: 不区分大小写）与续行缩进
+_ANSWER_Q_PREFIXES = ("q:", "Q:")
+_ANSWER_A_PREFIXES = ("a:", "A:")
+_ANSWER_INDENTS = ("  ", "\t")
+# 超过该长度的消息不进入 _normalize_answer_q 的缓存
+_ANSWER_NORMALIZE_CACHE_MAX_LEN = 100
+
+
+@lru_cache(maxsize=4096)
 def _normalize_answer_q(s: str) -> str:
+    # 常见消息（问候/命令）反复出现，缓存归一化结果
     # 触发词匹配：忽略首尾空白、大小写，内部连续空白视为一个空格
-    return re.sub(r"\s+", " ", (s or "").strip()).casefold()
+    return " ".join((s or "").split()).casefold()
 
 
-def _finalize_answer_block(questions: List[str], replies: List[str], table: Dict[str, List[str]]) -> None:
+def _finalize_answer_block(questions: List[str], replies: List[str], table: Dict[str, Tuple[str, ...]]) -> None:
     if not questions or not replies:
         return
-    rs = [x for x in replies if (x or "").strip()]
+    # 同一问答块的所有同义触发词共享同一个回复元组
+    rs = tuple(x for x in replies if (x or "").strip())
     if not rs:
         return
     for q in questions:
         k = _normalize_answer_q(q)
         if k:
-            table[k] = list(rs)
+            table[k] = rs
 
 
-def _parse_answer_txt(content: str) -> Dict[str, List[str]]:
+def _parse_answer_txt(content: str) -> Dict[str, Tuple[str, ...]]:
     """解析 answer.txt：
     - q: 触发词（可写多条，作为同义词）
     - a: 单行回复（可写多条，逐条发送）
     - a:| 多行回复（后续缩进行）
     """
     lines = content.splitlines()
-    table: Dict[str, List[str]] = {}
+    table: Dict[str, Tuple[str, ...]] = {}
     questions: List[str] = []
     replies: List[str] = []
 
@@ -85,8 +133,8 @@ def _parse_answer_txt(content: str) -> Dict[str, List[str]]:
             i += 1
             continue
 
-        low = stripped.lower()
-        if low.startswith("q:"):
+        lead = stripped[:2]
+        if lead in _ANSWER_Q_PREFIXES:
             # 若当前 block 已有回复，则新 q 代表新 block
             if questions and replies:
                 _finalize_answer_block(questions, replies, table)
@@ -97,7 +145,7 @@ def _parse_answer_txt(content: str) -> Dict[str, List[str]]:
             i += 1
             continue
 
-        if low.startswith("a:"):
+        if lead in _ANSWER_A_PREFIXES:
             body = stripped[2:].lstrip()
             # 多行回复：a:| + 后续缩进行
             if body == "|":
@@ -123,7 +171,7 @@ def _parse_answer_txt(content: str) -> Dict[str, List[str]]:
             continue
 
         # 兼容：若写成了缩进行，接到上一条回复后面
-        if replies and (raw.startswith("  ") or raw.startswith("\t")):
+        if replies and raw.startswith(_ANSWER_INDENTS):
             add = raw[2:] if raw.startswith("  ") else raw[1:]
             replies[-1] = replies[-1] + "\n" + add
             i += 1
@@ -136,7 +184,12 @@ def _parse_answer_txt(content: str) -> Dict[str, List[str]]:
 
 
 def _reload_answer_cache_if_needed() -> None:
-    global _ANSWER_CACHE_MTIME, _ANSWER_CACHE
+    global _ANSWER_CACHE_MTIME, _ANSWER_CACHE, _ANSWER_CACHE_CHECK_TS
+    now = time.monotonic()
+    if now - _ANSWER_CACHE_CHECK_TS < _ANSWER_CACHE_CHECK_INTERVAL:
+        return
+    _ANSWER_CACHE_CHECK_TS = now
+
     try:
         mtime = float(ANSWER_FILE_PATH.stat().st_mtime)
     except Exception:
@@ -155,52 +208,114 @@ def _reload_answer_cache_if_needed() -> None:
     _ANSWER_CACHE_MTIME = mtime
 
 
-def _lookup_fixed_answers(text: str) -> List[str]:
+def _lookup_fixed_answers(text: str) -> Tuple[str, ...]:
+    """返回缓存中的回复元组本身（只读，调用方不要修改）。"""
     _reload_answer_cache_if_needed()
-    return list(_ANSWER_CACHE.get(_normalize_answer_q(text), []))
+    # 长消息几乎不会重复，绕过归一化缓存，避免把 LRU 挤满
+    if len(text) > _ANSWER_NORMALIZE_CACHE_MAX_LEN:
+        return _ANSWER_CACHE.get(_normalize_answer_q.__wrapped__(text), ())
+    return _ANSWER_CACHE.get(_normalize_answer_q(text), ())
 
 
 def _fmt_mb(n_bytes: int) -> str:
-    try:
-        return f"{(float(n_bytes) / (1024 * 1024)):.2f}MB"
-    except Exception:
+    if not isinstance(n_bytes, (int, float)):
         return ""
+    return f"{n_bytes / (1024 * 1024):.2f}MB"
 
 
 def _is_large(n_bytes: Optional[int]) -> bool:
-    try:
-        return n_bytes is not None and int(n_bytes) >= LARGE_FILE_WARN_BYTES
-    except Exception:
-        return False
+    # 调用方传入的都是 int（或 None），无需再做类型转换
+    return n_bytes is not None and n_bytes >= LARGE_FILE_WARN_BYTES
 
 
 async def _warn_large_if_needed(api, ctx, logsvc: LogService, filename: str, n_bytes: Optional[int], mode: str):
     """大文件提示：mode in {'send','recv','zip'}"""
     if not _is_large(n_bytes):
         return
-    size_txt = _fmt_mb(int(n_bytes or 0))
+    size_txt = _fmt_mb(n_bytes)
     if mode == "recv":
         await reply(api, ctx, f"📎 收到文件「{filename}」约 {size_txt}，文件较大请耐心等待…", logsvc)
     elif mode == "zip":
         await reply(api, ctx, f"📦 将发送压缩包「{filename}」约 {size_txt}，文件较大请耐心等待…", logsvc)
     else:
         await reply(api, ctx, f"📤 即将发送文件「{filename}」约 {size_txt}，文件较大请耐心等待…", logsvc)
+
+
+def _with_bad_list(msg: str, bad_list: List[str]) -> str:
+    """在回复末尾附上失败条目（一次 join 拼接）。"""
+    if not bad_list:
+        return msg
+    return "\n".join((msg, "失败： " + ", ".join(bad_list)))
+
+
+# 提交流程中的“阶段”状态；pending_handin_files / pending_handin_overwrite 由调用方单独处理
+_HANDIN_FLOW_FIELDS = (
+    "pending_handin_wait_done",
+    "pending_handin_zip_name",
+    "pending_handin_name_input",
+    "pending_handin_choose",
+)
+
+
+# 以下状态记录手写 __slots__（dataclass 的 slots 参数要 3.10+）；
+# 有 __slots__ 时字段不能带默认值，构造时请传全所有字段
+@dataclass
+class PendingFile:
+    """待分配的收件箱文件（path 为本机临时路径，name 为展示/归档用文件名）。"""
+    __slots__ = ("path", "name", "ts")
+    path: str
+    name: str
+    ts: float
+
+
+@dataclass
+class ChooseState:
+    """等待用户回复序号选择任务。mode: submit / status / check / getzip / cancel"""
+    __slots__ = ("mode", "task_ids", "ts", "group_id")
+    mode: str
+    task_ids: List[str]
+    ts: float
+    group_id: Optional[int]  # 仅 cancel 会限定群；其余模式传 None
+
+
+@dataclass
+class OverwriteState:
+    """同名文件已存在，等待用户回复 Y/N 决定是否覆盖。"""
+    __slots__ = ("task_id", "path", "name", "ts")
+    task_id: str
+    path: str
+    name: str
+    ts: float
+
+
 @dataclass
 class BotState:
     last_find: Dict[str, List[Path]] = field(default_factory=dict)  # conv_key -> paths (for /get)
     last_find_label: Dict[str, str] = field(default_factory=dict)   # conv_key -> keyword/task-name (for zip naming)
     # Handin: user_id -> queue of inbox files
-    pending_handin_files: Dict[int, List[dict]] = field(default_factory=dict)
+    pending_handin_files: Dict[int, List[PendingFile]] = field(default_factory=dict)
     # Handin: user_id -> {"ts": float}（检测到多文件后，等待用户回复 done 再打包）
     pending_handin_wait_done: Dict[int, dict] = field(default_factory=dict)
     # Handin: user_id -> {"ts": float}（已 done，等待用户回复 zip 名称）
     pending_handin_zip_name: Dict[int, dict] = field(default_factory=dict)
     # Handin: user_id -> {"ts": float}（单文件未识别姓名时，等待用户补充姓名或回复 0 跳过）
     pending_handin_name_input: Dict[int, dict] = field(default_factory=dict)
-    # Handin: user_id -> {"mode": "submit"|"status"|"cancel", "task_ids":[...], "ts": float, "group_id": Optional[int]}
-    pending_handin_choose: Dict[int, dict] = field(default_factory=dict)
-    # Handin: user_id -> {"task_id": str, "path": str, "name": str, "ts": float}
-    pending_handin_overwrite: Dict[int, dict] = field(default_factory=dict)
+    # Handin: user_id -> 任务选择菜单
+    pending_handin_choose: Dict[int, ChooseState] = field(default_factory=dict)
+    # Handin: user_id -> 覆盖确认
+    pending_handin_overwrite: Dict[int, OverwriteState] = field(default_factory=dict)
+
+    def has_handin_flow(self, user_id: int) -> bool:
+        """该用户是否处于提交流程中（有覆盖确认或任一阶段状态）。"""
+        return user_id in self.pending_handin_overwrite or any(
+            user_id in getattr(self, name) for name in _HANDIN_FLOW_FIELDS
+        )
+
+    def clear_handin_flow(self, user_id: int, keep: Tuple[str, ...] = ()) -> None:
+        """清掉某用户的提交流程状态（done 等待/zip 命名/补充姓名/任务选择），keep 中的字段保留。"""
+        for name in _HANDIN_FLOW_FIELDS:
+            if name not in keep:
+                getattr(self, name).pop(user_id, None)
 
 
 def conv_key(ctx) -> str:
@@ -230,6 +345,22 @@ def _split_args(text: str):
     return cmd, rest
 
 
+@lru_cache(maxsize=4096)
+def _digit_like_value(ch: str) -> Optional[int]:
+    """“数字样字符”（①、¹、三 等）对应的整数值；不是则返回 None。结果按字符缓存。"""
+    try:
+        return int(unicodedata.digit(ch))
+    except Exception:
+        pass
+    try:
+        v = unicodedata.numeric(ch)
+        if float(v).is_integer():
+            return int(v)
+    except Exception:
+        pass
+    return None
+
+
 def _parse_indices(arg: str) -> List[int]:
     """
     支持：
@@ -242,34 +373,30 @@ def _parse_indices(arg: str) -> List[int]:
 
     s = str(arg).strip()
 
-    # 1) 全角数字 -> 半角
-    s = s.translate(str.maketrans("０１２３４５６７８９", "0123456789"))
-
     out: List[int] = []
 
-    # 2) 优先提取常规连续数字
-    nums = re.findall(r"[0-9]+", s)
-    for n in nums:
-        try:
-            out.append(int(n))
-        except Exception:
-            pass
+    if _ASCII_DIGIT_SEP.issuperset(s):
+        # 0) 快速路径："1" / "1 2 3" / "1,2,3"，结果与下面的正则提取一致
+        out = [int(n) for n in s.replace(",", " ").replace("，", " ").split()]
+    else:
+        # 1) 全角数字 -> 半角
+        s = s.translate(_FW_DIGIT_TRANS)
 
-    # 3) 如果没提取到，尝试把“数字样字符”转成数值（①、¹ 之类）
-    if not out:
-        for ch in s:
+        # 2) 优先提取常规连续数字
+        nums = _RE_DIGITS.findall(s)
+        for n in nums:
             try:
-                out.append(int(unicodedata.digit(ch)))
-                continue
-            except Exception:
-                pass
-            try:
-                v = unicodedata.numeric(ch)
-                if float(v).is_integer():
-                    out.append(int(v))
+                out.append(int(n))
             except Exception:
                 pass
 
+    # 3) 如果没提取到，尝试把“数字样字符”转成数值（①、¹ 之类）
+    if not out:
+        for ch in s:
+            v = _digit_like_value(ch)
+            if v is not None:
+                out.append(v)
+
     # 去重但保序
     seen = set()
     uniq: List[int] = []
@@ -285,7 +412,7 @@ def _sanitize_ascii_filename(name: str) -> str:
     p = Path(name)
     stem = p.stem
     suf = p.suffix
-    stem2 = re.sub(r"[^A-Za-z0-9._-]+", "_", stem).strip("._-")
+    stem2 = _RE_ASCII_UNSAFE.sub("_", stem).strip("._-")
     if not stem2:
         stem2 = "file"
     # 避免过长
@@ -293,16 +420,17 @@ def _sanitize_ascii_filename(name: str) -> str:
     return f"{stem2}{suf}"
 
 
-def _safe_zip_label(raw: str, default: str = "files") -> str:
-    safe = re.sub(r'[<>:"/\\|?*]+', "_", (raw or "").strip()).strip(" .")
-    safe = re.sub(r"\s+", "_", safe)
+def _safe_zip_label(raw: str, default: str = "files", max_len: Optional[int] = None) -> str:
+    safe = _RE_WIN_ILLEGAL.sub("_", (raw or "").strip()).strip(" .")
+    safe = _RE_WS.sub("_", safe)
+    if max_len is not None:
+        safe = safe[:max_len].strip("._-")
     return safe or default
 
 
 def _sanitize_submitter_name(raw: str) -> str:
-    s = (raw or "").strip()
-    s = re.sub(r"\s+", "", s)
-    s = re.sub(r'[<>:"/\\|?*\x00-\x1f]+', "", s)
+    s = "".join((raw or "").split())
+    s = s.translate(_WIN_ILLEGAL_CTRL_DELETE)
     s = s.strip("._-")
     return s[:20]
 
@@ -313,63 +441,186 @@ def _append_submitter_to_filename(filename: str, submitter_name: str) -> str:
     stem = p.stem if suf else p.name
     stem = stem.rstrip(" -_")
     new_name = f"{stem}-{submitter_name}{suf}"
-    new_name = re.sub(r'[<>:"/\\|?*]+', "_", new_name).strip(" .")
+    new_name = _RE_WIN_ILLEGAL.sub("_", new_name).strip(" .")
     return new_name or p.name
 
 
-def _rename_pending_file_with_submitter(item: dict, submitter_name: str) -> Tuple[bool, str]:
-    src = Path(str(item.get("path") or ""))
+def _reserve_unique_path(path: Path, limit: int = 1000) -> Optional[Path]:
+    """原子地占用 path（被占用则依次尝试 stem_2、stem_3…）。
+
+    用 O_CREAT|O_EXCL 创建空占位文件，返回占到的路径；全部被占用返回 None。
+    调用方随后用 os.replace 覆盖占位文件即可。
+    """
+    stem, suf = path.stem, path.suffix
+    for i in range(1, limit):
+        cand = path if i == 1 else path.with_name(f"{stem}_{i}{suf}")
+        try:
+            fd = os.open(cand, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return cand
+    return None
+
+
+def _rename_pending_file_with_submitter(item: PendingFile, submitter_name: str) -> Tuple[bool, str]:
+    src = Path(item.path)
     if (not src.exists()) or (not src.is_file()):
         return False, "临时文件不存在（可能已过期/被清理）。"
 
-    old_display_name = str(item.get("name") or src.name or "file")
+    old_display_name = item.name or src.name or "file"
     new_name = _append_submitter_to_filename(old_display_name, submitter_name)
     dst = src.with_name(new_name)
 
-    if str(dst) != str(src) and dst.exists():
-        stem = dst.stem
-        suf = dst.suffix
-        for i in range(2, 1000):
-            alt = src.with_name(f"{stem}_{i}{suf}")
-            if not alt.exists():
-                dst = alt
-                break
-
+    reserved: Optional[Path] = None
     try:
         if str(dst) != str(src):
-            src.replace(dst)
-        item["path"] = str(dst)
-        item["name"] = dst.name
+            reserved = _reserve_unique_path(dst)
+            if reserved is None:
+                # 只覆盖自己占到的占位文件：全被占用时不能退回原 dst（那是别人的文件）
+                return False, "同名文件过多，无法重命名，请修改文件名后重新发送。"
+            dst = reserved
+            os.replace(src, dst)
+        item.path = str(dst)
+        item.name = dst.name
         return True, dst.name
     except Exception as e:
+        if reserved is not None:
+            try:
+                os.unlink(reserved)
+            except OSError:
+                pass
         return False, f"重命名失败：{e}"
 
 
-def _cleanup_temp_files(paths: List[Path]) -> None:
+def _cleanup_temp_files(paths: List[str | Path]) -> None:
     for p in paths:
         try:
-            Path(p).unlink(missing_ok=True)
+            os.unlink(p)
         except Exception:
             pass
 
 
+def _open_zip(path: Path, compresslevel: Optional[int] = None) -> zipfile.ZipFile:
+    """新建一个写入用的 zip（DEFLATED）。所有临时打包统一走这里，压缩参数只需在一处调整。"""
+    return zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+
+
+# 临时文件名序号：进程内递增，配合时间戳与 pid 保证唯一，无需每次读 urandom
+_TEMP_NAME_SEQ = itertools.count(1)
+
+
+def _temp_name_tag() -> str:
+    return f"{int(time.time())}_{os.getpid() & 0xFFFF:x}_{next(_TEMP_NAME_SEQ):x}"
+
+
+# 打包 / staging / 删临时文件专用线程池：大批量 /get 打包只会在这里排队，
+# 不会占满默认线程池（OneBot HTTP 请求、文件下载走的是默认池）
+_FILE_IO_WORKERS = 4
+_FILE_IO_POOL = ThreadPoolExecutor(max_workers=_FILE_IO_WORKERS, thread_name_prefix="bot-fileio")
+
+
+async def _run_file_io(fn, *args):
+    """在专用线程池里执行阻塞的文件操作（打包/staging/清理）。"""
+    return await asyncio.get_running_loop().run_in_executor(_FILE_IO_POOL, fn, *args)
+
+
+# 后台清理任务的强引用，防止任务未完成就被回收
+_BACKGROUND_TASKS: Set[asyncio.Task] = set()
+
+
+def _cleanup_temp_files_later(paths: List[Path]) -> None:
+    """在后台线程里删除临时文件，不阻塞当前回复流程。"""
+    if not paths:
+        return
+    task = asyncio.get_running_loop().create_task(_run_file_io(_cleanup_temp_files, list(paths)))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+
+def _zip_write_file(zf: zipfile.ZipFile, path, arcname: str, compress_type: int) -> None:
+    """写入单个文件成员。与 ZipFile.write 等价，但用 1MB 缓冲拷贝（write 固定 8KB 一次）。"""
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    zinfo.compress_type = compress_type
+    # 与 ZipFile.write 一样沿用 zf 的压缩级别：3.13+ 是公开的 compress_level，旧版本只有 _compresslevel
+    try:
+        zinfo.compress_level = zf.compresslevel
+    except AttributeError:
+        zinfo._compresslevel = zf.compresslevel
+    with open(path, "rb") as src, zf.open(zinfo, "w") as dst:
+        shutil.copyfileobj(src, dst, _ZIP_COPY_BUFSIZE)
+
+
+def _zip_compress_type(name: str) -> int:
+    suf = os.path.splitext(name)[1].lower()
+    return zipfile.ZIP_STORED if suf in _PRECOMPRESSED_SUFFIXES else zipfile.ZIP_DEFLATED
+
+
+def _iter_files(root: Path):
+    """递归列出 root 下的文件，产出 (DirEntry, 相对路径 POSIX 形式)。
+
+    用 os.scandir 直接读目录项类型，避免逐个 Path 构造与 stat；
+    与 rglob 一致：不进入符号链接目录，但包含指向文件的符号链接；无权限读取的目录直接跳过。
+    """
+    stack = [(os.fspath(root), "")]
+    while stack:
+        dir_path, prefix = stack.pop()
+        try:
+            it = os.scandir(dir_path)
+        except PermissionError:
+            # 如 lost+found / System Volume Information：跳过该目录，不让整个打包失败
+            continue
+        with it:
+            for e in it:
+                rel = prefix + e.name
+                if e.is_dir(follow_symlinks=False):
+                    stack.append((e.path, rel + "/"))
+                elif e.is_file():
+                    yield e, rel
+
+
+def _stat_many(paths: List[Path]) -> List[Optional[os.stat_result]]:
+    """逐个 stat（跟随符号链接），失败的位置为 None。"""
+    out: List[Optional[os.stat_result]] = []
+    for p in paths:
+        try:
+            out.append(os.stat(p))
+        except OSError:
+            out.append(None)
+    return out
+
+
 def _zip_directory(src_dir: Path, out_zip: Path) -> Tuple[bool, str]:
     try:
         out_zip.parent.mkdir(parents=True, exist_ok=True)
-        with zipfile.ZipFile(out_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-            files = [p for p in src_dir.rglob("*") if p.is_file()]
-            if not files:
+        # 目录打包只为发送，瓶颈在 DEFLATE：用最快档，已压缩格式仍按后缀直接存储
+        with _open_zip(out_zip, compresslevel=1) as zf:
+            # 边遍历边写入：不先攒出完整文件列表，大目录也能尽早开始压缩
+            empty = True
+            for e, rel in _iter_files(src_dir):
+                _zip_write_file(zf, e.path, f"{src_dir.name}/{rel}", _zip_compress_type(e.name))
+                empty = False
+            if empty:
                 zf.writestr(f"{src_dir.name}/", "")
-            else:
-                for p in files:
-                    rel = p.relative_to(src_dir).as_posix()
-                    zf.write(p, arcname=f"{src_dir.name}/{rel}")
         return True, ""
     except Exception as e:
         return False, str(e)
 
 
-def _zip_pending_files(items: List[dict], out_zip: Path) -> Tuple[bool, str, int, int]:
+def _unique_arcname(arc0: str, idx: int, seen: Set[str]) -> str:
+    """zip 内重名时加序号前缀（idx_name），仍冲突再追加计数，保证条目名唯一。"""
+    arc = arc0
+    if arc in seen:
+        arc = f"{idx}_{arc0}"
+        n = 2
+        while arc in seen:
+            arc = f"{idx}_{n}_{arc0}"
+            n += 1
+    seen.add(arc)
+    return arc
+
+
+def _zip_pending_files(items: List[PendingFile], out_zip: Path) -> Tuple[bool, str, int, int]:
     """把待提交队列里的多个文件打成一个 zip。
 
     返回：(ok, msg, packed_count, missing_count)
@@ -378,19 +629,19 @@ def _zip_pending_files(items: List[dict], out_zip: Path) -> Tuple[bool, str, int
         out_zip.parent.mkdir(parents=True, exist_ok=True)
         packed = 0
         missing = 0
-        name_count: Dict[str, int] = {}
-        with zipfile.ZipFile(out_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        seen_arcs: Set[str] = set()
+        # 提交的多是图片/Office 文档，几乎压不动：用最快档，CPU 省一大截，体积只差一两个百分点
+        with _open_zip(out_zip, compresslevel=1) as zf:
             for idx, it in enumerate(items, 1):
-                p = Path(str(it.get("path") or ""))
-                if (not p.exists()) or (not p.is_file()):
+                # 队列里存的是字符串路径：直接用 os.path，一次 stat 判断是否为文件
+                path = it.path
+                if not os.path.isfile(path):
                     missing += 1
                     continue
-                arc0 = (str(it.get("name") or "").strip() or p.name or f"file_{idx}")
-                arc = arc0
-                name_count[arc0] = name_count.get(arc0, 0) + 1
-                if name_count[arc0] > 1:
-                    arc = f"{idx}_{arc0}"
-                zf.write(p, arcname=arc)
+                base = os.path.basename(path)
+                arc0 = (it.name.strip() or base or f"file_{idx}")
+                arc = _unique_arcname(arc0, idx, seen_arcs)
+                _zip_write_file(zf, path, arc, _zip_compress_type(base))
                 packed += 1
         if packed <= 0:
             try:
@@ -403,12 +654,40 @@ def _zip_pending_files(items: List[dict], out_zip: Path) -> Tuple[bool, str, int
         return False, f"打包失败：{e}", 0, 0
 
 
-def _suggest_batch_zip_basename(items: List[dict], user_id: int) -> str:
+def _pack_get_items(out_zip: Path, items: List[Tuple[int, Path, str]]) -> Tuple[int, List[str], int]:
+    """把 /get 选中的多个文件打成外层 zip（同步，供线程调用）。
+
+    返回：(packed_count, bad_list, zip_size)
+    """
+    packed = 0
+    bad: List[str] = []
+    seen_arcs: Set[str] = set()
+    with _open_zip(out_zip) as zf:
+        for idx, p, arc0 in items:
+            if not p.is_file():
+                bad.append(f"{idx}({arc0}:不存在)")
+                continue
+            arc = _unique_arcname(arc0, idx, seen_arcs)
+            _zip_write_file(zf, p, arc, _zip_compress_type(p.name))
+            packed += 1
+    # 大小在线程里顺手取好，调用方做大文件提示时不必再 stat
+    return packed, bad, out_zip.stat().st_size
+
+
+def _zip_single_file(src: Path, out_zip: Path) -> int:
+    """把单个文件打成 zip（zip 内保留原文件名），返回 zip 大小。"""
+    # 只用于发送失败后的重试：本身已压缩的格式直接存储，其余用最快档，尽快重发
+    with _open_zip(out_zip, compresslevel=1) as zf:
+        _zip_write_file(zf, src, src.name, _zip_compress_type(src.name))
+    return out_zip.stat().st_size
+
+
+def _suggest_batch_zip_basename(items: List[PendingFile], user_id: int) -> str:
     """根据文件名推断一个默认 zip 基名（不含 .zip）。"""
     nm = ""
     sid = ""
     for it in (items or []):
-        raw_name = str(it.get("name") or "").strip()
+        raw_name = it.name.strip()
         if (not nm) and raw_name:
             nm = extract_name_from_filename(raw_name)
         if (not sid) and raw_name:
@@ -416,7 +695,15 @@ def _suggest_batch_zip_basename(items: List[dict], user_id: int) -> str:
         if nm and sid:
             break
     base = f"{nm}-{sid}" if (nm and sid) else (sid or nm or f"handin_u{user_id}")
-    return _safe_zip_label(base, default=f"handin_u{user_id}")[:60].strip("._-") or f"handin_u{user_id}"
+    return _safe_zip_label(base, default=f"handin_u{user_id}", max_len=60)
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    """优先硬链接（同一文件系统时无需拷贝数据），失败（跨盘/不支持）再完整拷贝。"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
 
 
 def _stage_for_napcat(ctx, src: Path, display_name: Optional[str] = None) -> tuple[Optional[str], Optional[str], str]:
@@ -449,15 +736,15 @@ def _stage_for_napcat(ctx, src: Path, display_name: Optional[str] = None) -> tup
         staged_name = f"{stem}_{uuid.uuid4().hex[:10]}{suf}"
         dst = host_dir / staged_name
 
-        # 拷贝到 bind mount 目录（给 NapCat 容器读取）
+        # 放到 bind mount 目录（给 NapCat 容器读取）：同盘时硬链接，否则拷贝
         # 注意：Windows + Docker Desktop 的共享目录有时会有“同步延迟”，
         # 因此这里只负责把文件落盘；真正发送失败会在 _send_file 里自动重试。
-        shutil.copy2(src, dst)
+        _link_or_copy(src, dst)
 
         # 群聊额外镜像到私聊目录（用于群失败后私聊兜底）。
         if mirror_dir is not None:
             try:
-                shutil.copy2(src, mirror_dir / staged_name)
+                _link_or_copy(dst, mirror_dir / staged_name)
             except Exception:
                 pass
 
@@ -580,24 +867,46 @@ async def _send_file(api, ctx, container_path: str, name: str):
 
 
 def _handin_tasks_list_text(tasks) -> str:
+    # 连续提交多个文件时任务列表基本不变：按展示字段缓存渲染结果
+    return _render_tasks_list_text(tuple((t.name, t.group_id, t.deadline_ts) for t in tasks))
+
+
+@lru_cache(maxsize=64)
+def _render_tasks_list_text(rows: Tuple[Tuple[str, int, float], ...]) -> str:
     lines = ["请选择提交任务："]
-    for i, t in enumerate(tasks, 1):
-        lines.append(f"{i}. {t.name}（群 {t.group_id}，截止 {pretty_ts(t.deadline_ts)}）")
+    for i, (name, group_id, deadline_ts) in enumerate(rows, 1):
+        lines.append(f"{i}. {name}（群 {group_id}，截止 {pretty_ts(deadline_ts)}）")
     lines.append("回复数字选择；回复 0 取消（删除临时文件）。")
     return "\n".join(lines)
 
 
+def _task_status_tag(t, now: float) -> str:
+    if getattr(t, "cancelled", False):
+        return "已取消"
+    if now >= float(t.deadline_ts):
+        return "已截止"
+    if getattr(t, "closed", False):
+        return "已结束"
+    return "进行中"
+
+
+def _sort_tasks_for_display(tasks: list, now: float) -> None:
+    # 进行中优先，其次按截止时间倒序（两次稳定排序）
+    tasks.sort(key=attrgetter("deadline_ts"), reverse=True)
+    tasks.sort(key=lambda t: not t.is_active(now))
+
+
 async def _handle_private_file(api, ctx, evt: dict, logsvc: LogService, state: BotState, handin: HandinService) -> bool:
     """处理私聊发文件：下载到 inbox 并提示选择任务。返回是否已处理（True=已回复）。"""
     files = get_files(evt)
     if not files:
         return False
 
-    f0 = files[0]
-    fname = (f0.get("name") or "file").strip()
-    url = (f0.get("url") or "").strip()
-    file_id = (f0.get("file_id") or "").strip()
-    fsize = (f0.get("size") or "").strip()
+    g = files[0].get
+    fname = (g("name") or "file").strip()
+    url = (g("url") or "").strip()
+    file_id = (g("file_id") or "").strip()
+    fsize = (g("size") or "").strip()
 
     # 记录 IN（触发回复才会最终落盘）
     logsvc.log_in(ctx, f"[file] {fname}")
@@ -677,13 +986,21 @@ async def _handle_private_file(api, ctx, evt: dict, logsvc: LogService, state: B
         await reply(api, ctx, msg, logsvc)
         return True
 
+    # 以下分支反复读写会话状态：先把 state 上的字典和 user_id 绑定为局部变量
+    uid = ctx.user_id
+    pending_files = state.pending_handin_files
+    wait_done = state.pending_handin_wait_done
+    zip_name = state.pending_handin_zip_name
+    name_input = state.pending_handin_name_input
+    choose = state.pending_handin_choose
+
     # 入队
-    q = state.pending_handin_files.get(ctx.user_id) or []
-    q.append({"path": str(p), "name": fname, "ts": time.time()})
-    state.pending_handin_files[ctx.user_id] = q
+    q = pending_files.get(uid) or []
+    q.append(PendingFile(path=str(p), name=fname, ts=time.time()))
+    pending_files[uid] = q
 
     # 已进入“等待 zip 名称”阶段时，新文件继续加入队列并保持等待命名
-    if state.pending_handin_zip_name.get(ctx.user_id):
+    if zip_name.get(uid):
         await reply(
             api,
             ctx,
@@ -693,17 +1010,17 @@ async def _handle_private_file(api, ctx, evt: dict, logsvc: LogService, state: B
         return True
 
     # 正在等待“补充姓名”时，如果继续发了第 2 个文件，自动切换为多文件 done 流程
-    if state.pending_handin_name_input.get(ctx.user_id):
+    if name_input.get(uid):
         if len(q) >= 2:
-            state.pending_handin_name_input.pop(ctx.user_id, None)
+            name_input.pop(uid, None)
             tasks = handin.list_active_tasks()
             if not tasks:
-                state.pending_handin_choose.pop(ctx.user_id, None)
+                choose.pop(uid, None)
                 await reply(api, ctx, f"{msg}\n当前没有正在进行的提交任务。", logsvc)
                 return True
-            state.pending_handin_wait_done[ctx.user_id] = {"ts": time.time()}
-            state.pending_handin_zip_name.pop(ctx.user_id, None)
-            state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [t.task_id for t in tasks], "ts": time.time()}
+            wait_done[uid] = {"ts": time.time()}
+            zip_name.pop(uid, None)
+            choose[uid] = ChooseState(mode="submit", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=None)
             await reply(
                 api,
                 ctx,
@@ -715,11 +1032,11 @@ async def _handle_private_file(api, ctx, evt: dict, logsvc: LogService, state: B
         return True
 
     # 若已有待选择状态，且又收到了新文件：进入“等待 done 再批量打包”模式
-    pend = state.pending_handin_choose.get(ctx.user_id)
-    if pend and pend.get("mode") == "submit":
+    pend = choose.get(uid)
+    if pend and pend.mode == "submit":
         if len(q) >= 2:
-            state.pending_handin_wait_done[ctx.user_id] = {"ts": time.time()}
-            state.pending_handin_zip_name.pop(ctx.user_id, None)
+            wait_done[uid] = {"ts": time.time()}
+            zip_name.pop(uid, None)
             await reply(
                 api,
                 ctx,
@@ -736,16 +1053,16 @@ async def _handle_private_file(api, ctx, evt: dict, logsvc: LogService, state: B
         return True
 
     # 新一轮提交流程，清掉旧的 done 等待状态
-    state.pending_handin_wait_done.pop(ctx.user_id, None)
-    state.pending_handin_zip_name.pop(ctx.user_id, None)
-    state.pending_handin_name_input.pop(ctx.user_id, None)
+    wait_done.pop(uid, None)
+    zip_name.pop(uid, None)
+    name_input.pop(uid, None)
 
     # 单文件：优先检测文件名里是否已有名册姓名
     if len(q) == 1:
         roster_name = handin.find_roster_name_in_filename(fname)
         if not roster_name:
-            state.pending_handin_name_input[ctx.user_id] = {"ts": time.time()}
-            state.pending_handin_choose.pop(ctx.user_id, None)
+            name_input[uid] = {"ts": time.time()}
+            choose.pop(uid, None)
             lines = [
                 msg,
                 "检测到你发送了文件提交。",
@@ -756,13 +1073,13 @@ async def _handle_private_file(api, ctx, evt: dict, logsvc: LogService, state: B
             return True
         lines = [msg, f"已识别到姓名：{roster_name}。", _handin_tasks_list_text(tasks)]
         await reply(api, ctx, "\n".join(lines), logsvc)
-        state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [t.task_id for t in tasks], "ts": time.time()}
+        choose[uid] = ChooseState(mode="submit", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=None)
         return True
 
     # 多文件：仍按原有任务选择流程（若继续发送会自动转 done 打包）
     lines = [msg, "检测到你发送了文件提交。", _handin_tasks_list_text(tasks)]
     await reply(api, ctx, "\n".join(lines), logsvc)
-    state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [t.task_id for t in tasks], "ts": time.time()}
+    choose[uid] = ChooseState(mode="submit", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=None)
     return True
 
 
@@ -785,26 +1102,24 @@ async def _handle_private_overwrite_yesno(api, ctx, text: str, logsvc: LogServic
     q = state.pending_handin_files.get(ctx.user_id) or []
     if not q:
         state.pending_handin_overwrite.pop(ctx.user_id, None)
-        state.pending_handin_wait_done.pop(ctx.user_id, None)
-        state.pending_handin_zip_name.pop(ctx.user_id, None)
-        state.pending_handin_name_input.pop(ctx.user_id, None)
+        state.clear_handin_flow(ctx.user_id, keep=("pending_handin_choose",))
         await reply(api, ctx, "没有待处理的提交文件了。", logsvc)
         return True
 
     # 找到对应的队首（通常就是 q[0]）
     item_idx = 0
     for i, it in enumerate(q):
-        if str(it.get("path")) == str(pend.get("path")):
+        if it.path == pend.path:
             item_idx = i
             break
     item = q[item_idx]
 
-    tid = pend.get("task_id")
+    tid = pend.task_id
     task = handin._tasks.get(tid)
     if not task or not task.is_active():
         # 任务不可用，丢弃该文件
         try:
-            Path(item.get("path")).unlink(missing_ok=True)
+            os.unlink(item.path)
         except Exception:
             pass
         q.pop(item_idx)
@@ -817,41 +1132,36 @@ async def _handle_private_overwrite_yesno(api, ctx, text: str, logsvc: LogServic
     if ans in ("n", "no"):
         # 不覆盖：删除临时文件
         try:
-            Path(item.get("path")).unlink(missing_ok=True)
+            os.unlink(item.path)
         except Exception:
             pass
         q.pop(item_idx)
         state.pending_handin_files[ctx.user_id] = q
         state.pending_handin_overwrite.pop(ctx.user_id, None)
-        await reply(api, ctx, "已取消覆盖，请修改文件名后重新发送。", logsvc)
+        out = ["已取消覆盖，请修改文件名后重新发送。"]
     else:
-        ok, msg2, dst, code = handin.move_inbox_to_task(Path(item.get("path")), task, overwrite=True)
+        ok, msg2, dst, code = handin.move_inbox_to_task(Path(item.path), task, overwrite=True)
         if ok:
             q.pop(item_idx)
             state.pending_handin_files[ctx.user_id] = q
             state.pending_handin_overwrite.pop(ctx.user_id, None)
-            name = Path(dst).name if dst else (item.get("name") or "")
-            nm = extract_name_from_filename(name)
-            sid = extract_student_id(name)
-            warn = ""
-            await reply(api, ctx, msg2 + warn, logsvc)
+            out = [msg2]
         else:
             # 覆盖失败：保留文件，让用户重新选择或取消
             state.pending_handin_overwrite.pop(ctx.user_id, None)
-            await reply(api, ctx, f"{msg2}\n你可以重新回复任务序号，或回复 0 取消该文件。", logsvc)
+            out = [f"{msg2}\n你可以重新回复任务序号，或回复 0 取消该文件。"]
 
-    # 若还有文件继续分配
+    # 若还有文件继续分配（与上面的结果合成一条发送：少一次往返，且顺序确定）
     if state.pending_handin_files.get(ctx.user_id):
         tasks = handin.list_active_tasks()
         if tasks:
             state.pending_handin_name_input.pop(ctx.user_id, None)
-            state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [t.task_id for t in tasks], "ts": time.time()}
-            await reply(api, ctx, "你还有待分配的提交文件。\n" + _handin_tasks_list_text(tasks), logsvc)
+            state.pending_handin_choose[ctx.user_id] = ChooseState(mode="submit", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=None)
+            out.append("你还有待分配的提交文件。\n" + _handin_tasks_list_text(tasks))
     else:
-        state.pending_handin_wait_done.pop(ctx.user_id, None)
-        state.pending_handin_zip_name.pop(ctx.user_id, None)
-        state.pending_handin_name_input.pop(ctx.user_id, None)
+        state.clear_handin_flow(ctx.user_id, keep=("pending_handin_choose",))
 
+    await reply(api, ctx, "\n\n".join(out), logsvc)
     return True
 
 
@@ -873,24 +1183,20 @@ async def _handle_private_name_input(api, ctx, text: str, logsvc: LogService, st
 
     q = state.pending_handin_files.get(ctx.user_id) or []
     if not q:
-        state.pending_handin_name_input.pop(ctx.user_id, None)
-        state.pending_handin_wait_done.pop(ctx.user_id, None)
-        state.pending_handin_zip_name.pop(ctx.user_id, None)
-        state.pending_handin_choose.pop(ctx.user_id, None)
+        state.clear_handin_flow(ctx.user_id)
         await reply(api, ctx, "没有待处理的提交文件了。", logsvc)
         return True
 
     # 若等待姓名期间又变成多文件，转为 done 打包流程
     if len(q) >= 2:
-        state.pending_handin_name_input.pop(ctx.user_id, None)
+        state.clear_handin_flow(ctx.user_id, keep=("pending_handin_choose",))
         tasks = handin.list_active_tasks()
         if not tasks:
             state.pending_handin_choose.pop(ctx.user_id, None)
             await reply(api, ctx, "当前没有正在进行的提交任务。", logsvc)
             return True
         state.pending_handin_wait_done[ctx.user_id] = {"ts": time.time()}
-        state.pending_handin_zip_name.pop(ctx.user_id, None)
-        state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [tt.task_id for tt in tasks], "ts": time.time()}
+        state.pending_handin_choose[ctx.user_id] = ChooseState(mode="submit", task_ids=[tt.task_id for tt in tasks], ts=time.time(), group_id=None)
         await reply(api, ctx, "检测到你在批量发送文件，请发完后回复 done，我会先让你命名 zip，再让你选择归档任务。", logsvc)
         return True
 
@@ -901,7 +1207,7 @@ async def _handle_private_name_input(api, ctx, text: str, logsvc: LogService, st
         if not submitter_name:
             await reply(api, ctx, "姓名格式不合法，请重新发送姓名；若不需要姓名信息或是小组作业，请回复 0 跳过。", logsvc)
             return True
-        if re.fullmatch(r"\d+", submitter_name):
+        if submitter_name.isdecimal():
             await reply(api, ctx, "请发送姓名文本；若不需要姓名信息或是小组作业，请回复 0 跳过。", logsvc)
             return True
         ok_rename, msg_rename = _rename_pending_file_with_submitter(q[0], submitter_name)
@@ -911,9 +1217,7 @@ async def _handle_private_name_input(api, ctx, text: str, logsvc: LogService, st
         rename_note = f"已补充姓名到文件名：{msg_rename}"
 
     state.pending_handin_files[ctx.user_id] = q
-    state.pending_handin_name_input.pop(ctx.user_id, None)
-    state.pending_handin_wait_done.pop(ctx.user_id, None)
-    state.pending_handin_zip_name.pop(ctx.user_id, None)
+    state.clear_handin_flow(ctx.user_id, keep=("pending_handin_choose",))
 
     tasks = handin.list_active_tasks()
     if not tasks:
@@ -924,7 +1228,7 @@ async def _handle_private_name_input(api, ctx, text: str, logsvc: LogService, st
             await reply(api, ctx, "当前没有正在进行的提交任务。", logsvc)
         return True
 
-    state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [tt.task_id for tt in tasks], "ts": time.time()}
+    state.pending_handin_choose[ctx.user_id] = ChooseState(mode="submit", task_ids=[tt.task_id for tt in tasks], ts=time.time(), group_id=None)
     lines = []
     if rename_note:
         lines.append(rename_note)
@@ -933,10 +1237,27 @@ async def _handle_private_name_input(api, ctx, text: str, logsvc: LogService, st
     return True
 
 
+async def _resolve_chosen_task(api, ctx, logsvc: LogService, state: BotState, handin: HandinService, pend: ChooseState, choice: int,
+                               missing_msg: str = "任务不存在。", need_active: bool = False) -> Optional[Tuple[str, HandinTask]]:
+    """按回复的序号取出菜单里的任务；序号无效或任务不可用时回复用户并返回 None。"""
+    task_ids = pend.task_ids
+    if choice < 1 or choice > len(task_ids):
+        await reply(api, ctx, "序号无效，请重新回复数字。", logsvc)
+        return None
+    tid = task_ids[choice - 1]
+    task = handin._tasks.get(tid)  # internal lookup
+    if not task or (need_active and not task.is_active()):
+        state.pending_handin_choose.pop(ctx.user_id, None)
+        await reply(api, ctx, missing_msg, logsvc)
+        return None
+    return tid, task
+
+
 async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService, state: BotState, handin: HandinService, filesvc: FileService) -> bool:
     """处理私聊数字选择。返回是否已处理（True=已回复）。"""
     t = (text or "").strip()
-    if not re.fullmatch(r"\d{1,3}", t):
+    # 等价于 \d{1,3}（isdecimal 与 \d 同为 Unicode Nd 类），不走正则引擎
+    if not (t.isdecimal() and len(t) <= 3):
         return False
     pend = state.pending_handin_choose.get(ctx.user_id)
     if not pend:
@@ -946,7 +1267,7 @@ async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService,
     logsvc.log_in(ctx, t)
 
     choice = int(t)
-    mode = pend.get("mode")
+    mode = pend.mode
 
     if mode == "submit":
         # 若正在等待覆盖确认，先处理 Y/N
@@ -956,26 +1277,17 @@ async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService,
 
         q = state.pending_handin_files.get(ctx.user_id) or []
         if not q:
-            state.pending_handin_wait_done.pop(ctx.user_id, None)
-            state.pending_handin_zip_name.pop(ctx.user_id, None)
-            state.pending_handin_name_input.pop(ctx.user_id, None)
-            state.pending_handin_choose.pop(ctx.user_id, None)
+            state.clear_handin_flow(ctx.user_id)
             await reply(api, ctx, "没有待分配的文件了。", logsvc)
             return True
 
         # 多文件收集中：先等 done，再统一打包并选择任务
         if state.pending_handin_wait_done.get(ctx.user_id):
             if choice == 0:
-                for it in q:
-                    try:
-                        Path(str(it.get("path") or "")).unlink(missing_ok=True)
-                    except Exception:
-                        pass
+                # 批量删除放到线程里，一次往返处理整队文件
+                await _run_file_io(_cleanup_temp_files, [it.path for it in q])
                 state.pending_handin_files[ctx.user_id] = []
-                state.pending_handin_wait_done.pop(ctx.user_id, None)
-                state.pending_handin_zip_name.pop(ctx.user_id, None)
-                state.pending_handin_name_input.pop(ctx.user_id, None)
-                state.pending_handin_choose.pop(ctx.user_id, None)
+                state.clear_handin_flow(ctx.user_id)
                 await reply(api, ctx, "已取消并删除全部临时文件。", logsvc)
             else:
                 await reply(api, ctx, "检测到你在批量发送文件，请先发完后回复 done（随后会先让你命名 zip；回复 0 可取消全部临时文件）。", logsvc)
@@ -985,35 +1297,26 @@ async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService,
             item = q.pop(0)
             state.pending_handin_files[ctx.user_id] = q
             try:
-                Path(item["path"]).unlink(missing_ok=True)
+                os.unlink(item.path)
             except Exception:
                 pass
-            state.pending_handin_wait_done.pop(ctx.user_id, None)
-            state.pending_handin_zip_name.pop(ctx.user_id, None)
-            state.pending_handin_name_input.pop(ctx.user_id, None)
-            state.pending_handin_choose.pop(ctx.user_id, None)
+            state.clear_handin_flow(ctx.user_id)
             await reply(api, ctx, "已取消并删除临时文件。", logsvc)
             return True
 
-        task_ids = pend.get("task_ids") or []
-        if choice < 1 or choice > len(task_ids):
-            await reply(api, ctx, "序号无效，请重新回复数字。", logsvc)
-            return True
-
-        tid = task_ids[choice - 1]
-        task = handin._tasks.get(tid)  # internal lookup
-        if not task or not task.is_active():
-            await reply(api, ctx, "任务不存在或已结束，请重新发送文件。", logsvc)
-            state.pending_handin_choose.pop(ctx.user_id, None)
+        chosen = await _resolve_chosen_task(api, ctx, logsvc, state, handin, pend, choice,
+                                            "任务不存在或已结束，请重新发送文件。", need_active=True)
+        if chosen is None:
             return True
+        tid, task = chosen
 
         # 不先 pop，避免同名覆盖确认时丢失队列
         item = q[0]
-        ok, msg2, dst, code = handin.move_inbox_to_task(Path(item["path"]), task, overwrite=False)
+        ok, msg2, dst, code = handin.move_inbox_to_task(Path(item.path), task, overwrite=False)
 
         if (not ok) and code == "EXISTS":
             # 等待 Y/N
-            state.pending_handin_overwrite[ctx.user_id] = {"task_id": tid, "path": str(item["path"]), "name": item.get("name") or "", "ts": time.time()}
+            state.pending_handin_overwrite[ctx.user_id] = OverwriteState(task_id=tid, path=item.path, name=item.name, ts=time.time())
             state.pending_handin_choose.pop(ctx.user_id, None)
             await reply(api, ctx, f"{msg2}\n是否覆盖？(Y/N)", logsvc)
             return True
@@ -1027,38 +1330,29 @@ async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService,
         q.pop(0)
         state.pending_handin_files[ctx.user_id] = q
 
-        name = Path(dst).name if dst else (item.get("name") or "")
-        nm = extract_name_from_filename(name)
+        name = Path(dst).name if dst else item.name
+        # 学号只需一次正则；缺学号时必然提示，不必再跑姓名启发式
         sid = extract_student_id(name)
+        nm = extract_name_from_filename(name) if sid else ""
         warn = ""
         if not nm or not sid:
             warn = "\n（提示：文件名最好包含姓名和学号，例如 张三-U2024xxxxxx.docx）"
-        await reply(api, ctx, msg2 + warn, logsvc)
-
-        # 还有文件继续分配
+        # 还有文件继续分配（与归档结果合成一条发送：少一次往返，且顺序确定）
         if q:
             tasks = handin.list_active_tasks()
             state.pending_handin_name_input.pop(ctx.user_id, None)
-            state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [t.task_id for t in tasks], "ts": time.time()}
-            await reply(api, ctx, f"你还有 {len(q)} 份待分配文件。\n" + _handin_tasks_list_text(tasks), logsvc)
+            state.pending_handin_choose[ctx.user_id] = ChooseState(mode="submit", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=None)
+            await reply(api, ctx, msg2 + warn + f"\n\n你还有 {len(q)} 份待分配文件。\n" + _handin_tasks_list_text(tasks), logsvc)
         else:
-            state.pending_handin_wait_done.pop(ctx.user_id, None)
-            state.pending_handin_zip_name.pop(ctx.user_id, None)
-            state.pending_handin_name_input.pop(ctx.user_id, None)
-            state.pending_handin_choose.pop(ctx.user_id, None)
+            state.clear_handin_flow(ctx.user_id)
+            await reply(api, ctx, msg2 + warn, logsvc)
         return True
 
     if mode == "status":
-        task_ids = pend.get("task_ids") or []
-        if choice < 1 or choice > len(task_ids):
-            await reply(api, ctx, "序号无效，请重新回复数字。", logsvc)
-            return True
-        tid = task_ids[choice - 1]
-        task = handin._tasks.get(tid)
-        if not task:
-            await reply(api, ctx, "任务不存在。", logsvc)
-            state.pending_handin_choose.pop(ctx.user_id, None)
+        chosen = await _resolve_chosen_task(api, ctx, logsvc, state, handin, pend, choice)
+        if chosen is None:
             return True
+        _tid, task = chosen
 
         ok, msgx, missing, stats = handin.compute_missing(task)
         if ok:
@@ -1071,21 +1365,14 @@ async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService,
 
 
     if mode == "check":
-        task_ids = pend.get("task_ids") or []
         if choice == 0:
             state.pending_handin_choose.pop(ctx.user_id, None)
             await reply(api, ctx, "已取消操作。", logsvc)
             return True
-        if choice < 1 or choice > len(task_ids):
-            await reply(api, ctx, "序号无效，请重新回复数字。", logsvc)
-            return True
-
-        tid = task_ids[choice - 1]
-        task = handin._tasks.get(tid)
-        if not task:
-            await reply(api, ctx, "任务不存在。", logsvc)
-            state.pending_handin_choose.pop(ctx.user_id, None)
+        chosen = await _resolve_chosen_task(api, ctx, logsvc, state, handin, pend, choice)
+        if chosen is None:
             return True
+        _tid, task = chosen
 
         files = handin.list_submitted_files(task)
         k = conv_key(ctx)
@@ -1095,35 +1382,28 @@ async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService,
         if not files:
             await reply(api, ctx, f"任务「{task.name}」当前还没有提交文件。", logsvc)
         else:
-            lines = [f"📦 已提交文件列表（任务：{task.name}，共 {len(files)} 个）："]
-            for i, p in enumerate(files, 1):
-                lines.append(f"{i}. {p.name}")
-            lines.append("用 /get 序号（如/get 1 2 3 4）获取其中一个或多个文件。")
-            await reply(api, ctx, "\n".join(lines), logsvc)
+            header = f"📦 已提交文件列表（任务：{task.name}，共 {len(files)} 个）："
+            body = "\n".join(f"{i}. {p.name}" for i, p in enumerate(files, 1))
+            footer = "用 /get 序号（如/get 1 2 3 4）获取其中一个或多个文件。"
+            await reply(api, ctx, f"{header}\n{body}\n{footer}", logsvc)
 
         state.pending_handin_choose.pop(ctx.user_id, None)
         return True
 
     if mode == "getzip":
-        task_ids = pend.get("task_ids") or []
         if choice == 0:
             state.pending_handin_choose.pop(ctx.user_id, None)
             await reply(api, ctx, "已取消操作。", logsvc)
             return True
-        if choice < 1 or choice > len(task_ids):
-            await reply(api, ctx, "序号无效，请重新回复数字。", logsvc)
-            return True
-
-        tid = task_ids[choice - 1]
-        task = handin._tasks.get(tid)
-        if not task:
-            await reply(api, ctx, "任务不存在。", logsvc)
-            state.pending_handin_choose.pop(ctx.user_id, None)
+        chosen = await _resolve_chosen_task(api, ctx, logsvc, state, handin, pend, choice)
+        if chosen is None:
             return True
+        _tid, task = chosen
 
         safe = handin._safe_component(task.name)
         out_zip = (DATA_DIR / "temp" / "handin_exports" / f"{safe}_g{task.group_id}_{int(time.time())}.zip")
-        ok, msgz, zpath = handin.zip_submissions(task, out_zip)
+        # 打包与 staging 可能涉及数百 MB 的读写，放到线程里，避免卡住事件循环
+        ok, msgz, zpath = await _run_file_io(handin.zip_submissions, task, out_zip)
         if not ok or not zpath:
             await reply(api, ctx, msgz, logsvc)
             state.pending_handin_choose.pop(ctx.user_id, None)
@@ -1131,12 +1411,12 @@ async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService,
 
         # 大文件提示（打包后的 zip 将要发送）
         try:
-            await _warn_large_if_needed(api, ctx, logsvc, f"{task.name}.zip", int(Path(zpath).stat().st_size), mode="zip")
+            await _warn_large_if_needed(api, ctx, logsvc, f"{task.name}.zip", os.stat(zpath).st_size, mode="zip")
         except Exception:
             pass
 
         # 发送 zip：先 staging 到 NapCat 专用上传目录（/data/upload_*），再上传
-        cpath, send_name, stage_msg = _stage_for_napcat(ctx, zpath, display_name=f"{task.name}.zip")
+        cpath, send_name, stage_msg = await _run_file_io(_stage_for_napcat, ctx, zpath, f"{task.name}.zip")
         if not cpath:
             await reply(api, ctx, f"staging 失败：{stage_msg}", logsvc)
             state.pending_handin_choose.pop(ctx.user_id, None)
@@ -1168,14 +1448,14 @@ async def _handle_private_number_choice(api, ctx, text: str, logsvc: LogService,
 async def _handle_cancel_number_choice(api, ctx, text: str, logsvc: LogService, state: BotState, handin: HandinService) -> bool:
     """处理取消任务的数字选择（群聊/私聊均可）。返回是否已处理。"""
     t = (text or "").strip()
-    if not re.fullmatch(r"\d{1,3}", t):
+    if not (t.isdecimal() and len(t) <= 3):
         return False
     pend = state.pending_handin_choose.get(ctx.user_id)
-    if not pend or pend.get("mode") != "cancel":
+    if not pend or pend.mode != "cancel":
         return False
 
     # 若限定了群，则群里必须匹配该群
-    gid = pend.get("group_id", None)
+    gid = pend.group_id
     try:
         gid = int(gid) if gid is not None else None
     except Exception:
@@ -1193,17 +1473,11 @@ async def _handle_cancel_number_choice(api, ctx, text: str, logsvc: LogService,
         await reply(api, ctx, "已取消操作。", logsvc)
         return True
 
-    task_ids = pend.get("task_ids") or []
-    if choice < 1 or choice > len(task_ids):
-        await reply(api, ctx, "序号无效，请重新回复数字。", logsvc)
-        return True
-
-    tid = task_ids[choice - 1]
-    task = handin._tasks.get(tid)  # internal lookup
-    if not task or not task.is_active():
-        state.pending_handin_choose.pop(ctx.user_id, None)
-        await reply(api, ctx, "任务不存在或已结束。", logsvc)
+    chosen = await _resolve_chosen_task(api, ctx, logsvc, state, handin, pend, choice,
+                                        "任务不存在或已结束。", need_active=True)
+    if chosen is None:
         return True
+    tid, task = chosen
 
     # 权限：仅允许创建者或管理员取消
     if ctx.level < 3 and int(task.creator_id) != int(ctx.user_id):
@@ -1220,7 +1494,7 @@ async def _handle_cancel_number_choice(api, ctx, text: str, logsvc: LogService,
 async def _handle_find_folder_number_choice(api, ctx, text: str, logsvc: LogService, state: BotState) -> bool:
     """处理 /find 结果的“直接回复序号查看目录内容（仅下一级）”。"""
     t = (text or "").strip()
-    if not re.fullmatch(r"\d{1,3}", t):
+    if not (t.isdecimal() and len(t) <= 3):
         return False
 
     k = conv_key(ctx)
@@ -1244,15 +1518,18 @@ async def _handle_find_folder_number_choice(api, ctx, text: str, logsvc: LogServ
     if not p.is_dir():
         return False
 
+    # scandir 的 DirEntry 自带类型信息；只取前 LS_LIMIT 项，不必对整个目录排序
+    limit = int(LS_LIMIT)
     try:
-        entries = list(p.iterdir())
+        with os.scandir(p) as it:
+            all_entries = list(it)
     except Exception as e:
         await reply(api, ctx, f"读取目录失败：{e}", logsvc)
         return True
 
-    entries.sort(key=lambda x: (not x.is_dir(), x.name.lower()))
-    has_more = len(entries) > int(LS_LIMIT)
-    entries = entries[: int(LS_LIMIT)]
+    has_more = len(all_entries) > limit
+    top = heapq.nsmallest(limit, all_entries, key=lambda de: (not de.is_dir(), de.name.lower()))
+    entries = [Path(de.path) for de in top]
 
     # 下钻后刷新 /get 的候选列表，支持继续按数字进入下一层目录。
     state.last_find[k] = entries
@@ -1263,18 +1540,19 @@ async def _handle_find_folder_number_choice(api, ctx, text: str, logsvc: LogServ
         return True
 
     lines = [f"📁 {p.name}/ 下一级目录与文件："]
-    for i, child in enumerate(entries, 1):
-        if child.is_dir():
-            lines.append(f"{i}. 📁 {child.name}/")
+    # 复用 DirEntry 的类型判断；只有文件才取大小（DirEntry.stat 结果会被缓存）
+    for i, de in enumerate(top, 1):
+        if de.is_dir():
+            lines.append(f"{i}. 📁 {de.name}/")
             continue
         suffix = ""
         try:
-            sz = int(child.stat().st_size)
+            sz = de.stat().st_size
             if _is_large(sz):
                 suffix = f" （{_fmt_mb(sz)}，大文件）"
         except Exception:
             pass
-        lines.append(f"{i}. 📄 {child.name}{suffix}")
+        lines.append(f"{i}. 📄 {de.name}{suffix}")
 
     if has_more:
         lines.append(f"（当前目录项较多，仅显示前 {LS_LIMIT} 项）")
@@ -1302,21 +1580,23 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
         handled = await _handle_private_file(api, ctx, evt, logsvc, state, handin)
         if handled:
             return
-        handled = await _handle_private_overwrite_yesno(api, ctx, text, logsvc, state, handin)
-        if handled:
-            return
-        handled = await _handle_private_done_batch(api, ctx, text, logsvc, state, handin)
-        if handled:
-            return
-        handled = await _handle_private_zip_name_input(api, ctx, text, logsvc, state, handin)
-        if handled:
-            return
-        handled = await _handle_private_name_input(api, ctx, text, logsvc, state, handin)
-        if handled:
-            return
-        handled = await _handle_private_number_choice(api, ctx, text, logsvc, state, handin, filesvc)
-        if handled:
-            return
+        # 以下处理器都以某个待处理状态为前提：不在提交流程中的普通私聊直接跳过
+        if state.has_handin_flow(ctx.user_id):
+            handled = await _handle_private_overwrite_yesno(api, ctx, text, logsvc, state, handin)
+            if handled:
+                return
+            handled = await _handle_private_done_batch(api, ctx, text, logsvc, state, handin)
+            if handled:
+                return
+            handled = await _handle_private_zip_name_input(api, ctx, text, logsvc, state, handin)
+            if handled:
+                return
+            handled = await _handle_private_name_input(api, ctx, text, logsvc, state, handin)
+            if handled:
+                return
+            handled = await _handle_private_number_choice(api, ctx, text, logsvc, state, handin, filesvc)
+            if handled:
+                return
 
     handled = await _handle_cancel_number_choice(api, ctx, text, logsvc, state, handin)
     if handled:
@@ -1330,7 +1610,7 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
     # 记录 IN（只有最终 log_out 才会落盘）
     logsvc.log_in(ctx, t)
 
-    if not (t.startswith("/") or t.startswith("／")):
+    if not t.startswith(_CMD_PREFIXES):
         handled = await _handle_find_folder_number_choice(api, ctx, t, logsvc, state)
         if handled:
             return
@@ -1377,7 +1657,9 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
                 await reply(api, ctx, "当前没有等级 >=1 的用户。", logsvc)
                 return
 
-            ordered = sorted(uid_to_level.items(), key=lambda x: (-x[1], x[0]))
+            # 等级降序、QQ号升序：QQ号唯一，先按元组排序再按等级稳定排序，两次都在 C 层比较
+            ordered = sorted(uid_to_level.items())
+            ordered.sort(key=itemgetter(1), reverse=True)
             sem = asyncio.Semaphore(8)
 
             async def _fetch_nick(uid: int) -> str:
@@ -1387,37 +1669,48 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
                     except Exception:
                         return str(uid)
 
-            names = await asyncio.gather(*[_fetch_nick(uid) for uid, _ in ordered])
+            # 先查昵称缓存，只对未命中的用户并发请求
+            names = [api.get_cached_user_nickname(uid) for uid, _ in ordered]
+            miss = [i for i, name in enumerate(names) if name is None]
+            if miss:
+                fetched = await asyncio.gather(*[_fetch_nick(ordered[i][0]) for i in miss])
+                for i, name in zip(miss, fetched):
+                    names[i] = name
 
             lines = [
                 f">=1 级用户共 {len(ordered)} 人",
                 "等级 | QQ号 | 昵称",
             ]
-            for (uid, lv), name in zip(ordered, names):
-                lines.append(f"{lv} | {uid} | {name}")
-
-            # 避免消息过长导致发送失败，按长度切分多条发送
-            chunk: List[str] = []
-            cur_len = 0
-            for line in lines:
-                add_len = len(line) + 1
-                if chunk and (cur_len + add_len > 3000):
-                    await reply(api, ctx, "\n".join(chunk), logsvc)
-                    chunk = [line]
-                    cur_len = add_len
+            lines.extend(f"{lv} | {uid} | {name}" for (uid, lv), name in zip(ordered, names))
+
+            # 常见情况一条就能发完：整体拼接一次即可，不必逐行累计长度
+            text_all = "\n".join(lines)
+            if len(text_all) < 3000:
+                await reply(api, ctx, text_all, logsvc)
+                return
+
+            # 避免消息过长导致发送失败，按长度切分多条发送：
+            # 直接在已拼好的整段文本上找换行切片（每段不超过 2999 字），不再逐行累计后重新 join
+            start, n = 0, len(text_all)
+            while start < n:
+                if n - start < 3000:
+                    end = n
                 else:
-                    chunk.append(line)
-                    cur_len += add_len
-            if chunk:
-                await reply(api, ctx, "\n".join(chunk), logsvc)
+                    end = text_all.rfind("\n", start, start + 3000)
+                    if end <= start:  # 单行超长：整行单独一条
+                        end = text_all.find("\n", start + 1)
+                        if end < 0:
+                            end = n
+                await reply(api, ctx, text_all[start:end], logsvc)
+                start = end + 1
             return
 
         if len(parts) != 2:
             await reply(api, ctx, "用法：/level list\n或：/level QQ号 等级\n例如：/level 123456789 2", logsvc)
             return
 
-        uid_raw = parts[0].translate(str.maketrans("０１２３４５６７８９", "0123456789"))
-        lv_raw = parts[1].translate(str.maketrans("０１２３４５６７８９", "0123456789"))
+        uid_raw = parts[0].translate(_FW_DIGIT_TRANS)
+        lv_raw = parts[1].translate(_FW_DIGIT_TRANS)
         try:
             target_uid = int(uid_raw)
             target_lv = int(lv_raw)
@@ -1536,22 +1829,11 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
             return
 
         now = time.time()
-
-        def _status_tag(t):
-            if getattr(t, "cancelled", False):
-                return "已取消"
-            if now >= float(t.deadline_ts):
-                return "已截止"
-            if getattr(t, "closed", False):
-                return "已结束"
-            return "进行中"
-
-        # 进行中优先，其次按截止时间倒序
-        tasks.sort(key=lambda t: (0 if t.is_active(now) else 1, -float(t.deadline_ts)))
+        _sort_tasks_for_display(tasks, now)
 
         text_list = ["提交任务列表："]
         for i, tsk in enumerate(tasks, 1):
-            text_list.append(f"{i}. [{_status_tag(tsk)}] {tsk.name}（群 {tsk.group_id}，截止 {pretty_ts(tsk.deadline_ts)}）")
+            text_list.append(f"{i}. [{_task_status_tag(tsk, now)}] {tsk.name}（群 {tsk.group_id}，截止 {pretty_ts(tsk.deadline_ts)}）")
         text_list.append("回复数字选择任务，我会发送未提交名单（若姓名识别率过低会改发已提交文件列表；已截止任务也可查询）。")
 
         # 若在群里发，群里提示，列表私聊
@@ -1561,7 +1843,7 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
         else:
             await reply(api, ctx, "\n".join(text_list), logsvc)
 
-        state.pending_handin_choose[ctx.user_id] = {"mode": "status", "task_ids": [t.task_id for t in tasks], "ts": time.time()}
+        state.pending_handin_choose[ctx.user_id] = ChooseState(mode="status", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=None)
         return
     if cmd == "handincheck":
         if ctx.level < 2:
@@ -1576,21 +1858,11 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
             return
 
         now = time.time()
-
-        def _status_tag(t):
-            if getattr(t, "cancelled", False):
-                return "已取消"
-            if now >= float(t.deadline_ts):
-                return "已截止"
-            if getattr(t, "closed", False):
-                return "已结束"
-            return "进行中"
-
-        tasks.sort(key=lambda t: (0 if t.is_active(now) else 1, -float(t.deadline_ts)))
+        _sort_tasks_for_display(tasks, now)
 
         text_list = ["你创建的提交任务列表："]
         for i, tsk in enumerate(tasks, 1):
-            text_list.append(f"{i}. [{_status_tag(tsk)}] {tsk.name}（群 {tsk.group_id}，截止 {pretty_ts(tsk.deadline_ts)}）")
+            text_list.append(f"{i}. [{_task_status_tag(tsk, now)}] {tsk.name}（群 {tsk.group_id}，截止 {pretty_ts(tsk.deadline_ts)}）")
         text_list.append("回复数字选择任务（回复 0 取消），我会列出已提交文件列表（已截止任务也可查看）。")
 
         if ctx.scene == "group":
@@ -1599,7 +1871,7 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
         else:
             await reply(api, ctx, "\n".join(text_list), logsvc)
 
-        state.pending_handin_choose[ctx.user_id] = {"mode": "check", "task_ids": [t.task_id for t in tasks], "ts": time.time()}
+        state.pending_handin_choose[ctx.user_id] = ChooseState(mode="check", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=None)
         return
 
     if cmd == "handinget":
@@ -1615,21 +1887,11 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
             return
 
         now = time.time()
-
-        def _status_tag(t):
-            if getattr(t, "cancelled", False):
-                return "已取消"
-            if now >= float(t.deadline_ts):
-                return "已截止"
-            if getattr(t, "closed", False):
-                return "已结束"
-            return "进行中"
-
-        tasks.sort(key=lambda t: (0 if t.is_active(now) else 1, -float(t.deadline_ts)))
+        _sort_tasks_for_display(tasks, now)
 
         text_list = ["你创建的提交任务列表："]
         for i, tsk in enumerate(tasks, 1):
-            text_list.append(f"{i}. [{_status_tag(tsk)}] {tsk.name}（群 {tsk.group_id}，截止 {pretty_ts(tsk.deadline_ts)}）")
+            text_list.append(f"{i}. [{_task_status_tag(tsk, now)}] {tsk.name}（群 {tsk.group_id}，截止 {pretty_ts(tsk.deadline_ts)}）")
         text_list.append("回复数字选择任务（回复 0 取消），我会把已提交文件打包为 zip 并发送（已截止任务也可导出）。")
 
         if ctx.scene == "group":
@@ -1638,7 +1900,7 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
         else:
             await reply(api, ctx, "\n".join(text_list), logsvc)
 
-        state.pending_handin_choose[ctx.user_id] = {"mode": "getzip", "task_ids": [t.task_id for t in tasks], "ts": time.time()}
+        state.pending_handin_choose[ctx.user_id] = ChooseState(mode="getzip", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=None)
         return
 
 
@@ -1671,7 +1933,7 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
 
         await reply(api, ctx, "\n".join(text_list), logsvc)
 
-        state.pending_handin_choose[ctx.user_id] = {"mode": "cancel", "task_ids": [t.task_id for t in tasks], "group_id": pend_gid, "ts": time.time()}
+        state.pending_handin_choose[ctx.user_id] = ChooseState(mode="cancel", task_ids=[t.task_id for t in tasks], ts=time.time(), group_id=pend_gid)
         return
 
         return
@@ -1708,18 +1970,16 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
         dir_lines: List[str] = []
         file_lines: List[str] = []
         has_large = False
-        for i, p in enumerate(hits, 1):
-            if p.is_dir():
+        # 所有命中一次性在线程里 stat（每项一次，同时得到类型与大小）
+        stats = await asyncio.to_thread(_stat_many, hits)
+        for i, (p, st) in enumerate(zip(hits, stats), 1):
+            if st is not None and stat.S_ISDIR(st.st_mode):
                 dir_lines.append(f"{i}. 📁 {p.name}/")
                 continue
             suffix = ""
-            try:
-                sz = int(p.stat().st_size)
-                if _is_large(sz):
-                    suffix = f" （{_fmt_mb(sz)}，大文件）"
-                    has_large = True
-            except Exception:
-                pass
+            if st is not None and _is_large(st.st_size):
+                suffix = f" （{_fmt_mb(st.st_size)}，大文件）"
+                has_large = True
             file_lines.append(f"{i}. 📄 {p.name}{suffix}")
         lines = ["搜索结果："]
         lines.append(f"📁 文件夹命中：")
@@ -1764,6 +2024,7 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
         temp_artifacts: List[Path] = []
         try:
             prepared_items: list[tuple[int, Path, str]] = []
+            known_sizes: Dict[Path, int] = {}
             ok_list = []
             pending_list = []
             bad_list = []
@@ -1774,30 +2035,33 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
                     continue
 
                 src = hits[idx - 1]
-                if not src.exists():
+                # 一次 stat 同时判断存在性与类型，文件大小留给后面的大文件提示复用
+                try:
+                    st = src.stat()
+                except OSError:
                     bad_list.append(f"{idx}({src.name}:不存在)")
                     continue
 
-                if src.is_dir():
+                if stat.S_ISDIR(st.st_mode):
                     out_dir = (DATA_DIR / "temp" / "get_dir_zip")
                     out_dir.mkdir(parents=True, exist_ok=True)
                     safe_stem = Path(_sanitize_ascii_filename(f"{src.name}.zip")).stem[:40].strip("._-") or "folder"
-                    zpath = out_dir / f"{safe_stem}_{int(time.time())}_{uuid.uuid4().hex[:6]}.zip"
-                    ok_zip, msg_zip = _zip_directory(src, zpath)
+                    zpath = out_dir / f"{safe_stem}_{_temp_name_tag()}.zip"
+                    # 打包放到线程里，避免大目录压缩阻塞事件循环
+                    ok_zip, msg_zip = await _run_file_io(_zip_directory, src, zpath)
                     if not ok_zip:
                         bad_list.append(f"{idx}({src.name}:打包失败:{msg_zip})")
                         continue
                     temp_artifacts.append(zpath)
                     prepared_items.append((idx, zpath, f"{src.name}.zip"))
-                elif src.is_file():
+                elif stat.S_ISREG(st.st_mode):
                     prepared_items.append((idx, src, src.name))
+                    known_sizes[src] = st.st_size
                 else:
                     bad_list.append(f"{idx}({src.name}:不是文件或目录)")
 
             if not prepared_items:
-                msg = "没有可发送的有效条目。"
-                if bad_list:
-                    msg = "失败： " + ", ".join(bad_list)
+                msg = ("失败： " + ", ".join(bad_list)) if bad_list else "没有可发送的有效条目。"
                 await reply(api, ctx, msg, logsvc)
                 return
 
@@ -1808,42 +2072,27 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
 
                 out_dir = (DATA_DIR / "temp" / "get_zip")
                 out_dir.mkdir(parents=True, exist_ok=True)
-                outer_zip = out_dir / f"{safe_label}_{int(time.time())}_{uuid.uuid4().hex[:6]}.zip"
+                outer_zip = out_dir / f"{safe_label}_{_temp_name_tag()}.zip"
 
-                packed = 0
-                name_count: dict[str, int] = {}
                 try:
-                    with zipfile.ZipFile(outer_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                        for idx2, p, arc0 in prepared_items:
-                            if (not p.exists()) or (not p.is_file()):
-                                bad_list.append(f"{idx2}({arc0}:不存在)")
-                                continue
-                            arc = arc0
-                            name_count[arc] = name_count.get(arc, 0) + 1
-                            if name_count[arc] > 1:
-                                arc = f"{idx2}_{arc0}"
-                            zf.write(p, arcname=arc)
-                            packed += 1
+                    # 打包放到线程里，压缩期间事件循环照常处理其他消息
+                    packed, bad_pack, outer_size = await _run_file_io(_pack_get_items, outer_zip, prepared_items)
+                    bad_list.extend(bad_pack)
                 except Exception as e:
                     await reply(api, ctx, f"打包失败：{e}", logsvc)
                     return
 
                 if packed <= 0:
                     msg = "打包失败：没有可写入的文件。"
-                    if bad_list:
-                        msg += "\n失败： " + ", ".join(bad_list)
-                    await reply(api, ctx, msg, logsvc)
+                    await reply(api, ctx, _with_bad_list(msg, bad_list), logsvc)
                     return
 
                 temp_artifacts.append(outer_zip)
                 display_name = f"{label}.zip"
 
-                try:
-                    await _warn_large_if_needed(api, ctx, logsvc, display_name, int(outer_zip.stat().st_size), mode="zip")
-                except Exception:
-                    pass
+                await _warn_large_if_needed(api, ctx, logsvc, display_name, outer_size, mode="zip")
 
-                cpath, send_name, stage_msg = _stage_for_napcat(ctx, outer_zip, display_name=display_name)
+                cpath, send_name, stage_msg = await _run_file_io(_stage_for_napcat, ctx, outer_zip, display_name)
                 if not cpath:
                     await reply(api, ctx, f"staging 失败：{stage_msg}", logsvc)
                     return
@@ -1851,32 +2100,29 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
                 sent, detail = await _send_file(api, ctx, cpath, send_name)
                 if sent is True:
                     msg = f"✅ 已打包发送：{display_name}（共 {packed} 个条目）"
-                    if bad_list:
-                        msg += "\n失败： " + ", ".join(bad_list)
-                    await reply(api, ctx, msg, logsvc)
+                    await reply(api, ctx, _with_bad_list(msg, bad_list), logsvc)
                 elif sent is None:
                     msg = (
                         f"📦 已提交发送：{display_name}。"
                         + ((" " + detail) if detail else "")
                         + "若你已在 QQ 里看到文件卡片，可忽略。"
                     )
-                    if bad_list:
-                        msg += "\n失败： " + ", ".join(bad_list)
-                    await reply(api, ctx, msg, logsvc)
+                    await reply(api, ctx, _with_bad_list(msg, bad_list), logsvc)
                 else:
                     msg = "发送失败：" + (detail or "请确认 docker-compose 挂载、NapCat/QQ 账号权限。")
-                    if bad_list:
-                        msg += "\n失败： " + ", ".join(bad_list)
-                    await reply(api, ctx, msg, logsvc)
+                    await reply(api, ctx, _with_bad_list(msg, bad_list), logsvc)
                 return
 
             for idx, p, shown_name in prepared_items:
                 try:
-                    await _warn_large_if_needed(api, ctx, logsvc, shown_name, int(p.stat().st_size), mode="send")
+                    size = known_sizes.get(p)
+                    if size is None:
+                        size = p.stat().st_size
+                    await _warn_large_if_needed(api, ctx, logsvc, shown_name, size, mode="send")
                 except Exception:
                     pass
 
-                cpath, send_name, stage_msg = _stage_for_napcat(ctx, p, display_name=shown_name)
+                cpath, send_name, stage_msg = await _run_file_io(_stage_for_napcat, ctx, p, shown_name)
                 if not cpath:
                     bad_list.append(f"{idx}({shown_name}:{stage_msg or 'staging失败'})")
                     continue
@@ -1899,17 +2145,13 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
                                 fb_dir.mkdir(parents=True, exist_ok=True)
 
                                 safe_stem = Path(_sanitize_ascii_filename(p.name)).stem[:40].strip("._-") or "file"
-                                zpath = fb_dir / f"{safe_stem}_{int(time.time())}.zip"
-                                with zipfile.ZipFile(zpath, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                                    zf.write(p, arcname=p.name)
+                                zpath = fb_dir / f"{safe_stem}_{_temp_name_tag()}.zip"
+                                zsize = await _run_file_io(_zip_single_file, p, zpath)
                                 temp_artifacts.append(zpath)
 
-                                try:
-                                    await _warn_large_if_needed(api, ctx, logsvc, zpath.name, int(zpath.stat().st_size), mode="zip")
-                                except Exception:
-                                    pass
+                                await _warn_large_if_needed(api, ctx, logsvc, zpath.name, zsize, mode="zip")
 
-                                cpath2, _send_name2, stage_msg2 = _stage_for_napcat(ctx, zpath)
+                                cpath2, _send_name2, stage_msg2 = await _run_file_io(_stage_for_napcat, ctx, zpath)
                                 if not cpath2:
                                     bad_list.append(f"{idx}({shown_name}:zip staging失败:{stage_msg2})")
                                     did_zip_fallback = True
@@ -1950,14 +2192,14 @@ async def dispatch(api, ctx, evt: dict, text: str, filesvc: FileService, logsvc:
             await reply(api, ctx, "\n".join(msg_lines) if msg_lines else "没有发送任何文件。", logsvc)
             return
         finally:
-            _cleanup_temp_files(temp_artifacts)
+            _cleanup_temp_files_later(temp_artifacts)
 
     # 未知命令
     await reply(api, ctx, f"未知命令：/{cmd}（用 /help 查看）", logsvc)
 async def _handle_private_done_batch(api, ctx, text: str, logsvc: LogService, state: BotState, handin: HandinService) -> bool:
     """处理私聊批量文件的 done 指令：进入“等待 zip 命名”阶段。"""
     t = (text or "").strip()
-    if not re.fullmatch(r"(?i)/?done", t):
+    if not _RE_DONE.fullmatch(t):
         return False
     if not state.pending_handin_wait_done.get(ctx.user_id):
         return False
@@ -1970,24 +2212,21 @@ async def _handle_private_done_batch(api, ctx, text: str, logsvc: LogService, st
 
     q = state.pending_handin_files.get(ctx.user_id) or []
     if not q:
-        state.pending_handin_wait_done.pop(ctx.user_id, None)
-        state.pending_handin_zip_name.pop(ctx.user_id, None)
-        state.pending_handin_name_input.pop(ctx.user_id, None)
-        state.pending_handin_choose.pop(ctx.user_id, None)
+        state.clear_handin_flow(ctx.user_id)
         await reply(api, ctx, "没有待处理的提交文件了。", logsvc)
         return True
 
     # 仅 1 个文件时无需打包，直接回到任务选择
     if len(q) == 1:
-        state.pending_handin_wait_done.pop(ctx.user_id, None)
-        state.pending_handin_zip_name.pop(ctx.user_id, None)
+        state.clear_handin_flow(ctx.user_id, keep=("pending_handin_name_input", "pending_handin_choose"))
         tasks = handin.list_active_tasks()
         if not tasks:
-            state.pending_handin_name_input.pop(ctx.user_id, None)
-            state.pending_handin_choose.pop(ctx.user_id, None)
+            state.clear_handin_flow(ctx.user_id)
             await reply(api, ctx, "当前没有正在进行的提交任务。", logsvc)
             return True
-        one_name = str(q[0].get("name") or Path(str(q[0].get("path") or "")).name)
+        item0 = q[0]
+        # 有 name 时（绝大多数情况）不会再去拼 Path
+        one_name = item0.name or os.path.basename(item0.path)
         roster_name = handin.find_roster_name_in_filename(one_name)
         if not roster_name:
             state.pending_handin_name_input[ctx.user_id] = {"ts": time.time()}
@@ -1995,14 +2234,13 @@ async def _handle_private_done_batch(api, ctx, text: str, logsvc: LogService, st
             await reply(api, ctx, "当前仅有 1 个文件，无需打包。\n未在文件名中识别到班级名册姓名，请回复提交者姓名（或回复 0 跳过）。", logsvc)
             return True
         state.pending_handin_name_input.pop(ctx.user_id, None)
-        state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [tt.task_id for tt in tasks], "ts": time.time()}
+        state.pending_handin_choose[ctx.user_id] = ChooseState(mode="submit", task_ids=[tt.task_id for tt in tasks], ts=time.time(), group_id=None)
         await reply(api, ctx, f"当前仅有 1 个文件，无需打包。\n已识别到姓名：{roster_name}。\n" + _handin_tasks_list_text(tasks), logsvc)
         return True
 
     # 多文件：先询问 zip 名称
     suggested = _suggest_batch_zip_basename(q, ctx.user_id)
-    state.pending_handin_wait_done.pop(ctx.user_id, None)
-    state.pending_handin_name_input.pop(ctx.user_id, None)
+    state.clear_handin_flow(ctx.user_id, keep=("pending_handin_choose",))
     state.pending_handin_zip_name[ctx.user_id] = {"ts": time.time(), "suggested": suggested}
     await reply(
         api,
@@ -2029,27 +2267,17 @@ async def _handle_private_zip_name_input(api, ctx, text: str, logsvc: LogService
         await reply(api, ctx, "你有一个待确认的覆盖操作，请先回复 Y/N。", logsvc)
         return True
 
-    if t in ("0", "取消", "/cancel", "／cancel"):
+    if t in _ZIP_NAME_CANCEL_TOKENS:
         q_cancel = state.pending_handin_files.get(ctx.user_id) or []
-        for it in q_cancel:
-            try:
-                Path(str(it.get("path") or "")).unlink(missing_ok=True)
-            except Exception:
-                pass
+        await _run_file_io(_cleanup_temp_files, [it.path for it in q_cancel])
         state.pending_handin_files[ctx.user_id] = []
-        state.pending_handin_wait_done.pop(ctx.user_id, None)
-        state.pending_handin_zip_name.pop(ctx.user_id, None)
-        state.pending_handin_name_input.pop(ctx.user_id, None)
-        state.pending_handin_choose.pop(ctx.user_id, None)
+        state.clear_handin_flow(ctx.user_id)
         await reply(api, ctx, "已取消并删除全部临时文件。", logsvc)
         return True
 
     q = state.pending_handin_files.get(ctx.user_id) or []
     if not q:
-        state.pending_handin_wait_done.pop(ctx.user_id, None)
-        state.pending_handin_zip_name.pop(ctx.user_id, None)
-        state.pending_handin_name_input.pop(ctx.user_id, None)
-        state.pending_handin_choose.pop(ctx.user_id, None)
+        state.clear_handin_flow(ctx.user_id)
         await reply(api, ctx, "没有待处理的提交文件了。", logsvc)
         return True
 
@@ -2061,38 +2289,28 @@ async def _handle_private_zip_name_input(api, ctx, text: str, logsvc: LogService
     if not base:
         base = default_name
 
-    out_dir = DATA_DIR / "temp" / "handin_batch"
+    out_dir = _HANDIN_BATCH_DIR
     out_dir.mkdir(parents=True, exist_ok=True)
-    out_zip = out_dir / f"{base}.zip"
-    if out_zip.exists():
-        i = 2
-        while i < 1000:
-            p2 = out_dir / f"{base}_{i}.zip"
-            if not p2.exists():
-                out_zip = p2
-                break
-            i += 1
+    # 原子占位（base.zip / base_2.zip …），并发提交同名 zip 时不会互相覆盖。
+    # 只写入自己占到的路径：全被占用时不能退回 base.zip（那可能是别人待提交的 zip）
+    out_zip = _reserve_unique_path(out_dir / f"{base}.zip")
+    if out_zip is None:
+        await reply(api, ctx, f"同名压缩包过多（{base}.zip），请换一个名称重新回复。", logsvc)
+        return True
 
-    ok_zip, msg_zip, packed, missing = _zip_pending_files(q, out_zip)
+    # 打包放到线程里（传快照，避免与队列修改交错）
+    ok_zip, msg_zip, packed, missing = await _run_file_io(_zip_pending_files, list(q), out_zip)
     if not ok_zip:
+        _cleanup_temp_files_later([out_zip])
         await reply(api, ctx, msg_zip, logsvc)
         return True
 
     # 打包成功后删除原临时文件，仅保留 zip
-    for it in q:
-        try:
-            Path(str(it.get("path") or "")).unlink(missing_ok=True)
-        except Exception:
-            pass
+    await _run_file_io(_cleanup_temp_files, [it.path for it in q])
 
-    state.pending_handin_files[ctx.user_id] = [{
-        "path": str(out_zip),
-        "name": out_zip.name,
-        "ts": time.time(),
-    }]
-    state.pending_handin_wait_done.pop(ctx.user_id, None)
-    state.pending_handin_zip_name.pop(ctx.user_id, None)
-    state.pending_handin_name_input.pop(ctx.user_id, None)
+    now = time.time()
+    state.pending_handin_files[ctx.user_id] = [PendingFile(path=str(out_zip), name=out_zip.name, ts=now)]
+    state.clear_handin_flow(ctx.user_id, keep=("pending_handin_choose",))
 
     tasks = handin.list_active_tasks()
     if not tasks:
@@ -2100,7 +2318,7 @@ async def _handle_private_zip_name_input(api, ctx, text: str, logsvc: LogService
         await reply(api, ctx, f"已将 {packed} 个文件打包为：{out_zip.name}\n当前没有正在进行的提交任务。", logsvc)
         return True
 
-    state.pending_handin_choose[ctx.user_id] = {"mode": "submit", "task_ids": [tt.task_id for tt in tasks], "ts": time.time()}
+    state.pending_handin_choose[ctx.user_id] = ChooseState(mode="submit", task_ids=[tt.task_id for tt in tasks], ts=now, group_id=None)
     lines = [f"已将 {packed} 个文件打包为：{out_zip.name}。"]
     if missing > 0:
         lines.append(f"另有 {missing} 个文件未找到，已跳过。")
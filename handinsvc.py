@@ -10,6 +10,7 @@ import urllib.error
 import urllib.parse
 import shutil
 from dataclasses import dataclass, asdict, field
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Set
 from urllib.parse import urlparse, unquote
@@ -53,6 +54,10 @@ SEPARATORS = ["-", "_", "——", "—", "–", ";", "，", ",", " "]
 _RE_STU = re.compile(r"[Uu]\d{8,12}")  # 例如 U202412743
 _RE_ENG = re.compile(r"[A-Za-z]")
 _RE_NUM = re.compile(r"[Uu]?\d{4,}")
+_RE_NAME_TOKEN = re.compile(r"[\u4e00-\u9fff]{2,3}")
+_RE_HAN = re.compile(r"[\u4e00-\u9fff]+")
+_RE_WIN_ILLEGAL_CHAR = re.compile(r'[<>:"/\\|?*]')
+_RE_WS = re.compile(r"\s+")
 SUBMITTED_FILE_SUFFIXES = {".doc", ".docx", ".pdf", ".txt", ".zip", ".rar", ".7z", ".ppt", ".pptx", ".xls", ".xlsx"}
 
 def clean_filename(filename: str) -> str:
@@ -64,7 +69,7 @@ def clean_filename(filename: str) -> str:
     return stem
 
 def looks_like_name(token: str) -> bool:
-    if not re.fullmatch(r"[\u4e00-\u9fff]{2,3}", token):
+    if not _RE_NAME_TOKEN.fullmatch(token):
         return False
     for bad in BLACKLIST_SUBSTRINGS:
         if bad in token:
@@ -79,7 +84,7 @@ def extract_name_from_filename(filename: str) -> str:
             return tok
 
     for tok in tokens:
-        if not re.fullmatch(r"[\u4e00-\u9fff]+", tok):
+        if not _RE_HAN.fullmatch(tok):
             continue
         for sw in STRUCTURAL_WORDS:
             idx = tok.find(sw)
@@ -88,7 +93,7 @@ def extract_name_from_filename(filename: str) -> str:
                 if looks_like_name(prefix):
                     return prefix
 
-    chunks = re.findall(r"[\u4e00-\u9fff]+", part)
+    chunks = _RE_HAN.findall(part)
     candidates = []
     for chunk in chunks:
         for n in (3, 2):
@@ -197,7 +202,9 @@ def parse_mmdd_hhmm(s: str, now_ts: float) -> Optional[float]:
         return ts
 
 
+@lru_cache(maxsize=1024)
 def pretty_ts(ts: float) -> str:
+    # 截止/提醒时间戳固定不变，任务列表反复展示时直接复用格式化结果
     try:
         return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
     except Exception:
@@ -253,6 +260,10 @@ class HandinService:
         self._migrate_legacy_tree()
 
         self._tasks: Dict[str, HandinTask] = {}
+        # 正在进行任务的缓存（按截止时间升序）：任务变更必经 _save，在那里失效；
+        # 另外最早的截止时间一到，列表必然变化，届时自动重算
+        self._active_cache: Optional[List[HandinTask]] = None
+        self._active_cache_until: float = 0.0
         self._load()
 
         # 清理节流：避免每 10 秒全盘扫描
@@ -260,6 +271,8 @@ class HandinService:
         # 名册缓存（按 mtime 刷新）
         self._roster_cache_mtime: float = -1.0
         self._roster_cache: List[Tuple[str, str]] = []
+        # 名册姓名（去重、按长度倒序），随名册缓存一起失效
+        self._roster_names_cache: Optional[List[str]] = None
 
     def is_task_gettable(self, task: HandinTask) -> bool:
         """任务是否仍可 /handinget：归档未被清理且目录仍在。"""
@@ -367,6 +380,7 @@ class HandinService:
             self._tasks = {}
 
     def _save(self):
+        self._active_cache = None
         try:
             obj = {tid: asdict(t) for tid, t in self._tasks.items()}
             tmp = self.db_path.with_suffix(self.db_path.suffix + ".tmp")
@@ -381,6 +395,7 @@ class HandinService:
         if not path.exists():
             self._roster_cache = []
             self._roster_cache_mtime = -1.0
+            self._roster_names_cache = None
             return []
         try:
             mtime = float(path.stat().st_mtime)
@@ -394,18 +409,24 @@ class HandinService:
             data = []
         self._roster_cache = list(data or [])
         self._roster_cache_mtime = mtime
+        self._roster_names_cache = None
         return list(self._roster_cache)
 
     def _get_roster_names(self) -> List[str]:
+        """名册姓名（去重，长名优先）。结果随名册缓存复用，调用方不要修改。"""
+        roster = self._get_roster()
+        if self._roster_names_cache is not None:
+            return self._roster_names_cache
         names: List[str] = []
         seen: Set[str] = set()
-        for _, nm in self._get_roster():
+        for _, nm in roster:
             name = str(nm or "").strip()
             if (not name) or (name in seen):
                 continue
             seen.add(name)
             names.append(name)
-        names.sort(key=lambda s: len(s), reverse=True)
+        names.sort(key=len, reverse=True)
+        self._roster_names_cache = names
         return names
 
     def find_roster_name_in_filename(self, filename: str, roster_names: Optional[List[str]] = None) -> str:
@@ -414,7 +435,7 @@ class HandinService:
         if not fn:
             return ""
         stem = Path(fn).stem
-        compact = re.sub(r"\s+", "", stem)
+        compact = "".join(stem.split())
         names = roster_names if roster_names is not None else self._get_roster_names()
         for nm in names:
             if nm and (nm in stem or nm in compact):
@@ -522,8 +543,8 @@ class HandinService:
     @staticmethod
     def _safe_component(s: str, max_len: int = 80) -> str:
         s = (s or "").strip()
-        s = re.sub(r'[<>:"/\\|?*]', "_", s)
-        s = re.sub(r"\s+", " ", s).strip()
+        s = _RE_WIN_ILLEGAL_CHAR.sub("_", s)
+        s = _RE_WS.sub(" ", s).strip()
         s = s.rstrip(" .")
         if not s:
             s = "_"
@@ -532,25 +553,41 @@ class HandinService:
         return s
 
     # ----- task ops -----
-    def list_active_tasks(self) -> List[HandinTask]:
+    def _active_tasks(self) -> List[HandinTask]:
+        """正在进行的任务（按截止时间升序），返回缓存本身，调用方不要修改。"""
         now = time.time()
-        tasks = [t for t in self._tasks.values() if t.is_active(now)]
-        tasks.sort(key=lambda x: x.deadline_ts)
-        return tasks
+        cached = self._active_cache
+        if cached is None or now >= self._active_cache_until:
+            cached = [t for t in self._tasks.values() if t.is_active(now)]
+            cached.sort(key=lambda x: x.deadline_ts)
+            self._active_cache = cached
+            self._active_cache_until = float(cached[0].deadline_ts) if cached else float("inf")
+        return cached
+
+    def list_active_tasks(self) -> List[HandinTask]:
+        return list(self._active_tasks())
 
     def list_active_tasks_by_group(self, group_id: int) -> List[HandinTask]:
-        return [t for t in self.list_active_tasks() if int(t.group_id) == int(group_id)]
+        # 在已排好序的进行中任务里按群过滤，顺序不变
+        gid = int(group_id)
+        return [t for t in self._active_tasks() if int(t.group_id) == gid]
 
 
     def list_active_tasks_by_creator(self, creator_id: int) -> List[HandinTask]:
         """列出某个发起人创建的正在进行任务（跨群）。"""
-        return [t for t in self.list_active_tasks() if int(t.creator_id) == int(creator_id)]
+        uid = int(creator_id)
+        return [t for t in self._active_tasks() if int(t.creator_id) == uid]
 
     # ===== 新增：列出任务（包含已截止/已结束/已取消）=====
     def list_tasks(self, include_closed: bool = True) -> List[HandinTask]:
         """列出任务。include_closed=True 时包含已截止/已结束/已取消的任务。"""
-        tasks = list(self._tasks.values())
-        if not include_closed:
+        return self._sorted_tasks(self._tasks.values(), include_closed)
+
+    @staticmethod
+    def _sorted_tasks(tasks, include_closed: bool) -> List[HandinTask]:
+        if include_closed:
+            tasks = list(tasks)
+        else:
             tasks = [t for t in tasks if not t.closed]
         # 近期优先：按截止时间倒序
         tasks.sort(key=lambda x: float(x.deadline_ts), reverse=True)
@@ -558,20 +595,24 @@ class HandinService:
 
     def list_tasks_by_group(self, group_id: int, include_closed: bool = True) -> List[HandinTask]:
         """列出某群的任务（含已截止）。"""
-        return [t for t in self.list_tasks(include_closed=include_closed) if int(t.group_id) == int(group_id)]
+        gid = int(group_id)
+        return self._sorted_tasks((t for t in self._tasks.values() if int(t.group_id) == gid), include_closed)
 
     def list_tasks_by_creator(self, creator_id: int, include_closed: bool = True) -> List[HandinTask]:
         """列出某个发起人创建的任务（跨群，含已截止）。"""
-        return [t for t in self.list_tasks(include_closed=include_closed) if int(t.creator_id) == int(creator_id)]
+        uid = int(creator_id)
+        return self._sorted_tasks((t for t in self._tasks.values() if int(t.creator_id) == uid), include_closed)
 
     def list_submitted_files(self, task: HandinTask) -> List[Path]:
         """列出某任务已提交的文件（按修改时间倒序）。"""
         files_dir = self._task_files_dir(task.group_id, task.name)
         if not files_dir.exists():
             return []
-        out = [p for p in files_dir.iterdir() if p.is_file()]
-        out.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-        return out
+        # scandir 的 DirEntry 自带类型，stat 结果也会缓存：每个文件只 stat 一次
+        with os.scandir(files_dir) as it:
+            entries = [e for e in it if e.is_file()]
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        return [Path(e.path) for e in entries]
 
     def zip_submissions(self, task: HandinTask, out_zip: Path) -> Tuple[bool, str, Optional[Path]]:
         """将某任务已提交文件全部打包为 zip。"""
@@ -917,8 +958,8 @@ class HandinService:
         unknown_name_files: List[str] = []
         matched_name_files = 0
 
-        roster_name_set = {str(nm or "").strip() for _, nm in roster if str(nm or "").strip()}
-        roster_names = sorted(roster_name_set, key=lambda s: len(s), reverse=True)
+        roster_names = self._get_roster_names()
+        roster_name_set = set(roster_names)
 
         for p in self.list_submitted_files(task):
             # 统计所有已提交文件；仅跳过隐藏文件与临时分片
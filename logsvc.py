@@ -12,6 +12,7 @@ from router import Ctx
 
 # Windows 文件/文件夹名不允许这些字符：<>:"/\|?*
 _WIN_ILLEGAL = re.compile(r'[<>:"/\\|?*]')
+_WS = re.compile(r"\s+")
 
 
 def _safe_component(s: str, max_len: int = 80) -> str:
@@ -20,7 +21,7 @@ def _safe_component(s: str, max_len: int = 80) -> str:
     if not s:
         return "_"
     s = _WIN_ILLEGAL.sub("_", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _WS.sub(" ", s).strip()
     # 去掉末尾点和空格（Windows 也不允许）
     s = s.rstrip(" .")
     if not s:
@@ -83,10 +83,11 @@ class OneBotAPI:
     # ========= WS 回包（仅兜底） =========
     def feed_response(self, data: dict):
         echo = data.get("echo")
-        if echo and echo in self._pending:
-            fut = self._pending.pop(echo)
-            if not fut.done():
-                fut.set_result(data)
+        if not echo:
+            return
+        fut = self._pending.pop(echo, None)
+        if fut is not None and not fut.done():
+            fut.set_result(data)
 
     async def _call_ws(self, action: str, params: dict, timeout: float) -> Optional[dict]:
         echo = f"{action}_{int(time.time() * 1000)}"
@@ -241,15 +242,22 @@ class OneBotAPI:
             timeout=6.0,
         )
 
-    async def get_user_nickname(self, user_id: int, ttl_seconds: float = 6 * 3600) -> str:
-        uid = int(user_id)
-        now = time.time()
-        cached = self._user_name_cache.get(uid)
+    def get_cached_user_nickname(self, user_id: int, ttl_seconds: float = 6 * 3600) -> Optional[str]:
+        """只查昵称缓存，不发请求；未命中或已过期返回 None。"""
+        cached = self._user_name_cache.get(int(user_id))
         if cached:
             name, ts = cached
-            if now - ts <= float(ttl_seconds) and name:
+            if time.time() - ts <= float(ttl_seconds) and name:
                 return str(name)
+        return None
 
+    async def get_user_nickname(self, user_id: int, ttl_seconds: float = 6 * 3600) -> str:
+        uid = int(user_id)
+        cached = self.get_cached_user_nickname(uid, ttl_seconds)
+        if cached is not None:
+            return cached
+
+        now = time.time()
         try:
             resp = await self.get_stranger_info(uid, no_cache=True)
             if resp and resp.get("status") == "ok":
@@ -6,6 +6,8 @@ from typing import Optional
 from config import ADMIN_USERS, GROUP_LEVEL, DEFAULT_LEVEL
 from permsvc import PermService
 
+_RE_CQ_FILE = re.compile(r"\[CQ:file,([^\]]+)\]")
+
 @dataclass
 class Ctx:
     scene: str                 # group / private_friend / private_group / private_stranger
@@ -128,7 +130,7 @@ def get_files(evt: dict) -> list[dict]:
     raw = evt.get("raw_message") or ""
     if isinstance(raw, str) and "CQ:file" in raw:
         # very light parse
-        m = re.search(r"\[CQ:file,([^\]]+)\]", raw)
+        m = _RE_CQ_FILE.search(raw)
         if m:
             kvs = m.group(1).split(",")
             data = {}